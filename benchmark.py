@@ -0,0 +1,510 @@
+"""
+Parsing throughput benchmark.
+
+    python benchmark.py [n_messages]
+
+Generates synthetic WhatsApp exports and reports messages/sec for the
+current parser, the streaming parser and the original split/findall/re.match
+implementation kept below for comparison, plus one fixture per registered
+export format, process-pool scaling, the bytes/message of the parsed frame,
+utils.stats against its original per-message loops and the conversation
+dynamics on a DYNAMICS_MESSAGES-message chat against DYNAMICS_BUDGET.
+
+    python benchmark.py --suite [--sizes 10000 100000 1000000] [--output results.json]
+                                [--compare baseline.json] [--tolerance 0.25] [--only PATTERN]
+
+Times (best of --repeat) and measures the tracemalloc peak of every public
+function of preprocessing.py, utils.py and dynamics.py at each size, writes
+the results as JSON and, with --compare, flags cases slower or larger than
+the baseline by more than --tolerance (exit status 1 when any regressed).
+"""
+import io
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import random
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import preprocessing as pre
+
+
+USERS = ['Alice', 'Bob Smith', 'Carol', '+91 98765 43210', 'Dave', 'Eve']
+WORDS = ['hello', 'ok', 'lol', 'see', 'you', 'tomorrow', 'at', 'the', 'office', 'thanks', 'sure', 'what', 'time']
+EMOJIS = ['\U0001f602', '\u2764\ufe0f', '\U0001f44d', '\U0001f64f', '\U0001f62d', '\U0001f525',
+          '\U0001f468\u200d\U0001f469\u200d\U0001f467', '\U0001f1ee\U0001f1f3', '\U0001f44d\U0001f3fd']
+
+
+def synthetic_chat(n_messages, n_users=len(USERS), seed=0, chat_format=pre.DEFAULT_FORMAT,
+                   system_rate=0.02, media_rate=0.08, multiline_rate=0.1, url_rate=0.01, emoji_rate=0.0):
+    """
+    Deterministic WhatsApp export of `n_messages` messages in `chat_format`.
+    The rates are the share of messages that are system lines, media
+    placeholders, two-line messages and messages with a link; `emoji_rate`
+    is the share of text messages that end with an emoji. Users past the
+    built-in USERS are named "User <n>".
+    """
+    rng = random.Random(seed)
+    users = USERS[:n_users] + [f"User {i}" for i in range(len(USERS) + 1, n_users + 1)]
+    template = pre.FORMATS[chat_format]['template']
+    datetime_format = pre.FORMATS[chat_format]['datetime_format']
+    media_below = system_rate + media_rate
+    multiline_below = media_below + multiline_rate
+    url_below = multiline_below + url_rate
+    # Start past the 12th so day-first and month-first fixtures are unambiguous
+    timestamp = datetime(2023, 1, 13, 9, 0)
+    lines = []
+    for _ in range(n_messages):
+        timestamp += timedelta(minutes=rng.randint(0, 120))
+        header = template.format(timestamp.strftime(datetime_format))
+        roll = rng.random()
+        user = rng.choice(users)
+        if roll < system_rate:
+            lines.append(f"{header}{user} joined using this group's invite link\n")
+            continue
+        if roll < media_below:
+            lines.append(f"{header}{user}: <Media omitted>\n")
+            continue
+
+        if roll < multiline_below:
+            text = f"{' '.join(rng.choices(WORDS, k=5))}\n{' '.join(rng.choices(WORDS, k=4))}"
+        elif roll < url_below:
+            text = f"see https://example.com/{rng.randint(0, 999)} {rng.choice(WORDS)}"
+        else:
+            text = ' '.join(rng.choices(WORDS, k=rng.randint(1, 12)))
+        if emoji_rate and rng.random() < emoji_rate:
+            text += ' ' + rng.choice(EMOJIS)
+        lines.append(f"{header}{user}: {text}\n")
+    return ''.join(lines)
+
+
+def legacy_preprocess_data(data):
+    # Original three-pass parser (re.split + re.findall + per-row re.match)
+    initial_pattern = r"\d{1,2}/\d{1,2}/\d{1,2},\s\d{1,2}:\d{1,2}\s[PA]M\s-\s"
+
+    messages = re.split(initial_pattern, data)[1:]
+    messages = [message.replace('\n', '') if message.endswith('\n') else message for message in messages]
+
+    dates = re.findall(initial_pattern, data)
+    dates = [date.replace('\u202f', ' ')[:-3] for date in dates]
+
+    df = pd.DataFrame({'user_message': messages, 'message_date': dates})
+
+    df['message_date'] = pd.to_datetime(df['message_date'], format='%m/%d/%y, %I:%M %p')
+
+    users = []
+    messages = []
+    for message in df['user_message']:
+        pattern = r'^([^\n:]+):\s([^\n:][\W\w]+)'
+        match = re.match(pattern, message)
+        if match:
+            users.append(match.group(1))
+            messages.append(match.group(2))
+        else:
+            users.append('Whatsapp')
+            messages.append(message)
+
+    df['user'] = users
+    df['message'] = messages
+
+    df['date'] = df['message_date'].dt.date
+    df['year'] = df['message_date'].dt.year
+    df['month'] = df['message_date'].dt.month_name()
+    df['week'] = df['message_date'].dt.isocalendar().week
+    df['day'] = df['message_date'].dt.day
+    df['day_name'] = df['message_date'].dt.day_name()
+    df['hour'] = df['message_date'].dt.strftime('%I')
+    df['minute'] = df['message_date'].dt.minute
+    df['meridiem'] = df['message_date'].dt.strftime('%p')
+    df.drop(columns=['user_message', 'message_date', ], inplace=True)
+    return df
+
+
+def legacy_stats(df, selected_user):
+    # Original per-message Python loops of utils.stats (text metrics only)
+    if selected_user != 'All':
+        df = df[df['user'] == selected_user]
+    all_messages = df['message'].to_list()
+    total_words = sum(len(message.split()) for message in all_messages)
+    total_media_messages = df[df['message'] == '<Media omitted>'].shape[0]
+    from urlextract import URLExtract
+    extractor = URLExtract()
+    total_links = sum(len(extractor.find_urls(message)) for message in all_messages)
+    total_characters = sum(len(message) for message in all_messages)
+    longest_message_length = len(max(all_messages, key=len)) if all_messages else 0
+    shortest_message_length = len(min(all_messages, key=len)) if all_messages else 0
+    return total_words, total_media_messages, total_links, total_characters, longest_message_length, shortest_message_length
+
+
+# Modules main.py imports before the first upload, and the wall-clock budget for them
+MAIN_IMPORTS = ['streamlit', 'preprocessing', 'utils', 'dynamics', 'charts', 'ingest', 'profiling', 'cache', 'chat']
+IMPORT_TIME_BUDGET = 3.0
+
+
+def _best_of(func, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_parsing(n_messages=100_000, repeat=3):
+    data = synthetic_chat(n_messages)
+    raw = data.encode('utf-8')
+
+    parsers = {
+        'legacy': lambda: legacy_preprocess_data(data),
+        'preprocess_data': lambda: pre.preprocess_data(data),
+        'preprocess_stream': lambda: pre.preprocess_stream(io.BytesIO(raw)),
+    }
+
+    results = {}
+    for name, parser in parsers.items():
+        seconds = _best_of(parser, repeat)
+        results[name] = n_messages / seconds
+        print(f"{name:<20} {seconds:8.3f} s  {results[name]:>12,.0f} msg/s")
+
+    print(f"{'speedup':<20} {results['preprocess_data'] / results['legacy']:8.2f}x")
+    return results
+
+
+def bench_formats(n_messages=50_000, repeat=3):
+    # One fixture per registered export format, parsed with auto-detection
+    results = {}
+    for chat_format in pre.FORMATS:
+        data = synthetic_chat(n_messages, chat_format=chat_format)
+        detected = pre.detect_format(data[:pre.SNIFF_SIZE])
+        assert detected == chat_format, f"{chat_format} detected as {detected}"
+
+        seconds = _best_of(lambda: pre.preprocess_data(data), repeat)
+        results[chat_format] = n_messages / seconds
+        print(f"{chat_format:<22} {seconds:8.3f} s  {results[chat_format]:>12,.0f} msg/s")
+    return results
+
+
+def bench_parallel(n_messages=1_000_000, workers=(1, 2, 4, 8, 16), repeat=1):
+    # Scaling of the process-pool tokenizer; workers=1 is the serial path
+    data = synthetic_chat(n_messages)
+    results = {}
+    for n_workers in workers:
+        if n_workers > 1:
+            parse = lambda: pre._parse_parallel(data, pre.DEFAULT_FORMAT, n_workers)
+        else:
+            parse = lambda: pre._parse_chunk(data, pre.DEFAULT_FORMAT)
+        seconds = _best_of(parse, repeat)
+        results[n_workers] = n_messages / seconds
+        print(f"{n_workers:>3} workers {seconds:8.3f} s  {results[n_workers]:>12,.0f} msg/s  {results[n_workers] / results[workers[0]]:6.2f}x")
+    return results
+
+
+def bench_memory(n_messages=100_000):
+    # Memory footprint of the parsed frame: original object schema vs compact schema
+    data = synthetic_chat(n_messages)
+    frames = {
+        'legacy': legacy_preprocess_data(data),
+        'compact': pre.preprocess_data(data, workers=1),
+    }
+    usage = pd.DataFrame({name: df.memory_usage(deep=True, index=False) for name, df in frames.items()})
+    usage.loc['total'] = usage.sum()
+    usage['saved'] = 1 - usage['compact'] / usage['legacy']
+    print((usage[['legacy', 'compact']] / n_messages).round(1).assign(saved=usage['saved'].map('{:.0%}'.format)).to_string())
+
+    for name, df in frames.items():
+        seconds = _best_of(lambda: df.groupby(['day_name', 'hour', 'meridiem'], observed=True)['message'].count())
+        print(f"{name:<10} day/hour groupby {seconds * 1000:8.1f} ms")
+    return usage
+
+
+def bench_stats(n_messages=1_000_000, repeat=1):
+    # utils.stats against the original per-message loops on the same chat
+    import utils
+    from chat import Chat
+
+    chat = Chat(pre.preprocess_data(synthetic_chat(n_messages)))
+    utils.get_url_extractor()
+
+    legacy = _best_of(lambda: legacy_stats(chat.df, 'All'), repeat)
+    current = _best_of(lambda: utils.stats(chat, 'All'), repeat)
+    print(f"{'legacy stats':<20} {legacy:8.3f} s")
+    print(f"{'utils.stats':<20} {current:8.3f} s  {legacy / current:6.2f}x")
+    return legacy, current
+
+
+# Messages of the bench_dynamics chat, and the per-metric budget at that size
+DYNAMICS_MESSAGES = 5_000_000
+DYNAMICS_BUDGET = 1.0
+
+
+def dynamics_chat(n_messages, n_users=20, seed=0):
+    # Only the columns the dynamics read (user, epoch) of a busy group writing
+    # every 0-10 minutes; parsing millions of lines would dwarf the metrics
+    from chat import Chat
+
+    rng = np.random.default_rng(seed)
+    users = [pre.SYSTEM_USER] + [f"User {i}" for i in range(1, n_users + 1)]
+    codes = np.where(rng.random(n_messages) < 0.02, 0, rng.integers(1, n_users + 1, n_messages))
+    epochs = pd.Timestamp('2023-01-13 09:00').value // 10**9 + np.cumsum(rng.integers(0, 601, n_messages))
+    return Chat(pd.DataFrame({'user': pd.Categorical.from_codes(codes, categories=users), 'epoch': epochs}))
+
+
+def bench_dynamics(n_messages=DYNAMICS_MESSAGES, budget=DYNAMICS_BUDGET):
+    # Every dynamics metric on a fresh chat, so building the sessions is included
+    import dynamics
+
+    metrics = {
+        'conversation_sessions': dynamics.conversation_sessions,
+        'conversation_starters': dynamics.conversation_starters,
+        'session_stats': lambda chat: dynamics.session_stats(chat, 'User 1'),
+        'reply_latency': dynamics.reply_latency,
+        'reply_latency (user)': lambda chat: dynamics.reply_latency(chat, 'User 1'),
+    }
+    chat_seconds = {}
+    for name, metric in metrics.items():
+        chat = dynamics_chat(n_messages)
+        chat.user_codes, chat.epochs
+        start = time.perf_counter()
+        metric(chat)
+        seconds = chat_seconds[name] = time.perf_counter() - start
+        status = 'ok' if seconds <= budget else 'OVER BUDGET'
+        print(f"{name:<24} {seconds:8.3f} s  ({n_messages:,} messages, budget {budget:.1f} s, {status})")
+    return chat_seconds
+
+
+def bench_import(budget=IMPORT_TIME_BUDGET):
+    # Fresh interpreter per run so nothing is already in sys.modules
+    code = 'import time; start = time.perf_counter(); import ' + ', '.join(MAIN_IMPORTS) + '; print(time.perf_counter() - start)'
+    # Run from the repo so its modules import wherever the benchmark is started from
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    seconds = float(result.stdout.strip())
+
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    top_level = {}
+    for line in result.stderr.splitlines():
+        _, cumulative, name = line.rsplit('|', 2)
+        if name.strip() in MAIN_IMPORTS:
+            top_level[name.strip()] = int(cumulative) / 1e6
+    for name in MAIN_IMPORTS:
+        if name in top_level:
+            print(f"{name:<20} {top_level[name]:8.3f} s")
+
+    status = 'ok' if seconds <= budget else 'OVER BUDGET'
+    print(f"{'main.py imports':<20} {seconds:8.3f} s  (budget {budget:.1f} s, {status})")
+    return seconds
+
+
+# Benchmark suite: fixture shape, sizes and regression threshold
+SUITE_SIZES = [10_000, 100_000, 1_000_000]
+SUITE_CHAT = {'n_users': 12, 'multiline_rate': 0.1, 'media_rate': 0.08, 'url_rate': 0.02, 'emoji_rate': 0.05}
+REGRESSION_TOLERANCE = 0.25
+# Differences below these are noise, whatever the ratio
+MIN_SECONDS_DELTA = 0.005
+MIN_BYTES_DELTA = 1 << 20
+
+
+def suite_cases(data):
+    """
+    name -> (setup, run) for every public function of preprocessing.py,
+    utils.py and dynamics.py, plus Chat.between and the approximate modes; run(setup()) is what gets
+    measured. utils functions get a
+    fresh Chat each time so per-chat caches never hide the real cost.
+    """
+    import utils
+    import dynamics
+    from chat import Chat
+
+    raw = data.encode('utf-8')
+    df = pre.preprocess_data(data)
+    chat_format = df.attrs['chat_format']
+    messages = df['message'].to_numpy()
+    text = messages[messages != '<Media omitted>']
+    frames = [df.iloc[:len(df) // 2].copy(), df.iloc[len(df) // 2:].copy()]
+
+    def fresh_chat():
+        return Chat(df.copy())
+
+    # The middle half of the chat's time span
+    epochs = df['epoch'].to_numpy()
+    quarter = (epochs[-1] - epochs[0]) // 4 if len(epochs) else 0
+    middle = [pd.Timestamp(epochs[0] + quarter, unit='s'), pd.Timestamp(epochs[0] + 3 * quarter, unit='s')] if len(epochs) else [None, None]
+
+    def on_chat(func, *args):
+        return fresh_chat, lambda chat: func(chat, *args)
+
+    def constant(value):
+        return lambda: value
+
+    return {
+        'preprocessing.detect_format': (constant(data[:pre.SNIFF_SIZE]), pre.detect_format),
+        'preprocessing.chunk_bounds': (constant(data), lambda data: pre.chunk_bounds(data, 8, chat_format)),
+        'preprocessing.preprocess_data': (constant(data), lambda data: pre.preprocess_data(data, workers=1)),
+        'preprocessing.iter_messages': (lambda: io.BytesIO(raw), lambda source: sum(1 for _ in pre.iter_messages(source))),
+        'preprocessing.preprocess_stream': (lambda: io.BytesIO(raw), pre.preprocess_stream),
+        'preprocessing.preprocess_buffer': (constant(raw), lambda raw: pre.preprocess_buffer(raw, workers=1)),
+        'preprocessing.concat_frames': (lambda: [frame.copy() for frame in frames], pre.concat_frames),
+        'preprocessing.sort_by_time': (lambda: df.iloc[::-1].reset_index(drop=True), pre.sort_by_time),
+        'utils.count_urls': (constant(messages), utils.count_urls),
+        'utils.extract_emojis': (constant(' '.join(text)), utils.extract_emojis),
+        'utils.sentiment_scores': (constant(text), lambda texts: utils.sentiment_scores(texts, workers=1)),
+        'utils.wordcloud_frequencies': (constant(text), utils.wordcloud_frequencies),
+        'utils.summary_table': on_chat(utils.summary_table),
+        'utils.stats': on_chat(utils.stats, 'All'),
+        'utils.most_busy_user': on_chat(utils.most_busy_user, 'All'),
+        'utils.create_wordcloud': on_chat(utils.create_wordcloud, 'All'),
+        'utils.most_busy_month': on_chat(utils.most_busy_month, 'All'),
+        'utils.most_busy_day': on_chat(utils.most_busy_day, 'All'),
+        'utils.most_busy_week': on_chat(utils.most_busy_week, 'All'),
+        'utils.most_busy_hour': on_chat(utils.most_busy_hour, 'All'),
+        'utils.heatmap_activity': on_chat(utils.heatmap_activity, 'All'),
+        'utils.get_line_chat_of_message_history': on_chat(utils.get_line_chat_of_message_history, 'All', 'W', 4),
+        'chat.Chat.between': on_chat(Chat.between, *middle),
+        'utils.get_averages': on_chat(utils.get_averages, 'All'),
+        'utils.compare_users': (fresh_chat, lambda chat: utils.compare_users(chat, ['All', *chat.users])),
+        'utils.token_counter': on_chat(utils.token_counter, 'words', 'All'),
+        'utils.most_used_words_and_emojies': on_chat(utils.most_used_words_and_emojies, 'All'),
+        'utils.most_used_words_and_emojies[approximate]': on_chat(utils.most_used_words_and_emojies, 'All', True),
+        'utils.approximate_most_common': on_chat(utils.approximate_most_common, 'words', 'All', 5),
+        'utils.most_common_tokens': on_chat(utils.most_common_tokens, 'words', 'All', 20),
+        'utils.sample_messages': (constant(text), utils.sample_messages),
+        'utils.distinct_counts': on_chat(utils.distinct_counts, 'All'),
+        'utils.distinct_counts[approximate]': on_chat(utils.distinct_counts, 'All', True),
+        'utils.sentiment_analysis': on_chat(utils.sentiment_analysis, 'All'),
+        'utils.sentiment_table': on_chat(utils.sentiment_table, 'All'),
+        'utils.mention_matrix': on_chat(utils.mention_matrix),
+        'utils.get_most_mentioned_users': on_chat(utils.get_most_mentioned_users, 'All'),
+        'dynamics.conversation_sessions': on_chat(dynamics.conversation_sessions),
+        'dynamics.session_stats': on_chat(dynamics.session_stats, 'All'),
+        'dynamics.conversation_starters': on_chat(dynamics.conversation_starters),
+        'dynamics.reply_latency': on_chat(dynamics.reply_latency, 'All'),
+    }
+
+
+def _measure(setup, run, repeat):
+    seconds = float('inf')
+    for _ in range(repeat):
+        argument = setup()
+        start = time.perf_counter()
+        run(argument)
+        seconds = min(seconds, time.perf_counter() - start)
+
+    # Separate run for memory, since tracing slows allocation down
+    argument = setup()
+    tracemalloc.start()
+    try:
+        run(argument)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': seconds, 'peak_bytes': peak}
+
+
+def run_suite(sizes=SUITE_SIZES, repeat=3, only=None):
+    import utils
+
+    # Model loading is paid once per process, not per call. A model that is
+    # not installed fails again in the cases using it, which are skipped
+    for load in (utils.get_nlp, utils.get_sentiment_analyzer, utils.get_url_extractor, utils.get_stop_words):
+        try:
+            load()
+        except RuntimeError:
+            pass
+    results = {}
+    for n_messages in sizes:
+        data = synthetic_chat(n_messages, **SUITE_CHAT)
+        results[str(n_messages)] = size_results = {}
+        for name, (setup, run) in suite_cases(data).items():
+            if only and not re.search(only, name):
+                continue
+            try:
+                size_results[name] = _measure(setup, run, repeat if n_messages < 1_000_000 else 1)
+            except RuntimeError as error:
+                # e.g. an optional model that is not installed
+                size_results[name] = {'error': str(error)}
+                print(f"{n_messages:>9,} {name:<45} skipped: {error}")
+                continue
+            print(f"{n_messages:>9,} {name:<45} {size_results[name]['seconds']:9.4f} s  {size_results[name]['peak_bytes'] / 2**20:9.1f} MiB")
+
+    return {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'chat': SUITE_CHAT,
+        },
+        'results': results,
+    }
+
+
+def compare_results(current, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Print current vs baseline for every case present in both and return the
+    regressions as (size, name, metric, ratio) tuples.
+    """
+    regressions = []
+    for size, cases in current['results'].items():
+        for name, result in cases.items():
+            base = baseline['results'].get(size, {}).get(name)
+            if base is None or 'error' in base or 'error' in result:
+                continue
+            flags = []
+            for metric, min_delta in (('seconds', MIN_SECONDS_DELTA), ('peak_bytes', MIN_BYTES_DELTA)):
+                ratio = result[metric] / base[metric] if base[metric] else 1.0
+                if ratio > 1 + tolerance and result[metric] - base[metric] > min_delta:
+                    regressions.append((size, name, metric, ratio))
+                    flags.append(f"{metric} REGRESSED")
+            time_ratio = result['seconds'] / base['seconds'] if base['seconds'] else 1.0
+            memory_ratio = result['peak_bytes'] / base['peak_bytes'] if base['peak_bytes'] else 1.0
+            print(f"{int(size):>9,} {name:<45} {time_ratio:6.2f}x time  {memory_ratio:6.2f}x memory  {', '.join(flags)}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Parser throughput report, or the JSON benchmark suite with --suite.')
+    parser.add_argument('n_messages', nargs='?', type=int, default=100_000)
+    parser.add_argument('--suite', action='store_true', help='time and measure every public function')
+    parser.add_argument('--sizes', nargs='+', type=int, default=SUITE_SIZES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', help='regex selecting suite cases by name')
+    parser.add_argument('--output', help='write suite results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to flag regressions against')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    if not args.suite:
+        bench_parsing(args.n_messages)
+        bench_formats(args.n_messages)
+        bench_parallel(args.n_messages)
+        bench_memory(args.n_messages)
+        bench_stats(args.n_messages)
+        bench_dynamics()
+        bench_import()
+        return 0
+
+    current = run_suite(args.sizes, args.repeat, args.only)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(current, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare_results(current, baseline, args.tolerance)
+        print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,331 @@
+import io
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+import preprocessing as pre
+from chat import Chat
+
+
+# Bump whenever the parsed frame schema changes so stale on-disk entries are ignored
+CACHE_VERSION = 2
+
+DEFAULT_MAX_ENTRIES = 8
+# Total size of the Parquet copies kept under cache_dir
+DEFAULT_MAX_DISK_BYTES = 1 << 30
+
+DEFAULT_FIGURE_CACHE_BYTES = 64 << 20
+# Matches what st.pyplot renders with, capped at Streamlit's maximum image
+# width so cached PNGs are displayed as-is instead of being resized per view
+FIGURE_DPI = 200
+FIGURE_MAX_WIDTH = 1460
+
+# Re-exports of a chat start with the same bytes; entries are indexed by a
+# hash of this many leading bytes to find the export a new upload extends
+PREFIX_SIZE = 4096
+TAIL_WINDOW = 64 << 10
+
+
+def content_hash(raw) -> str:
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def parse_bytes(raw, chat_format=None, workers=None):
+    # Never decoded whole: small exports are streamed through the
+    # incremental decoder, large ones parsed in byte ranges on the pool
+    return pre.preprocess_buffer(raw, chat_format=chat_format, workers=workers)
+
+
+def last_message_start(raw, chat_format) -> int:
+    """
+    Byte offset of the last message header in `raw`, found by decoding only
+    the end of the export (the window grows until a header is seen).
+    """
+    line_start = pre.FORMATS[chat_format]['line_start']
+    window = TAIL_WINDOW
+    while True:
+        start = max(len(raw) - window, 0)
+        # Never decode from the middle of a UTF-8 sequence
+        while start and raw[start] & 0xC0 == 0x80:
+            start -= 1
+        text = bytes(raw[start:]).decode('utf-8')
+        last = None
+        for last in line_start.finditer(text):
+            pass
+        if last is not None:
+            return start + len(text[:last.start()].encode('utf-8'))
+        if start == 0:
+            return 0
+        window *= 2
+
+
+class ParseCache:
+    """
+    Parsed chats keyed by a hash of the uploaded bytes.
+    Keeps up to `max_entries` Chat objects in memory (least recently used are
+    evicted) and, when `cache_dir` is set, a Parquet copy of every parsed chat
+    so re-uploading the same export skips parsing entirely. Copies are
+    deleted least recently used first once they exceed `max_disk_bytes`.
+
+    An upload whose leading bytes are exactly a stored export is treated as a
+    re-export of that chat: only the bytes from the stored last message on
+    are parsed, and the stored Chat is extended with them.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, cache_dir=None, max_disk_bytes=DEFAULT_MAX_DISK_BYTES):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.extends = 0
+        self._entries = OrderedDict()
+        # key -> {'size', 'prefix', 'last_start', 'chat_format'} of every stored export
+        self._records = {}
+        # Streamlit serves every session from its own thread
+        self._lock = threading.Lock()
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            for name in os.listdir(cache_dir):
+                if name.endswith(f"-v{CACHE_VERSION}.json"):
+                    with open(os.path.join(cache_dir, name)) as file:
+                        self._records[name.rsplit('-', 1)[0]] = json.load(file)
+
+    def _path(self, key, suffix='parquet'):
+        return os.path.join(self.cache_dir, f"{key}-v{CACHE_VERSION}.{suffix}")
+
+    def _write(self, path, write):
+        # Write to a temporary name first so readers never see a partial file
+        write(path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def _write_record(self, path, record):
+        with open(path, 'w') as file:
+            json.dump(record, file)
+
+    def _read(self, key):
+        # Stored copy of `key`, or None when there is none: another session's
+        # _evict_disk may delete the file at any time. The file's mtime
+        # records its last use for the disk tier's LRU order
+        path = self._path(key)
+        try:
+            chat = Chat(pd.read_parquet(path))
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return chat
+
+    def _evict_disk(self, keep):
+        # Delete the least recently used copies (never `keep`, just written)
+        # until the stored Parquet files fit in max_disk_bytes
+        suffix = f"-v{CACHE_VERSION}.parquet"
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(suffix):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.name[:-len(suffix)]))
+        total = sum(size for _, size, _ in files)
+        for _, size, key in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            if key == keep:
+                continue
+            with self._lock:
+                self._records.pop(key, None)
+            for path in (self._path(key), self._path(key, 'json')):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+    def _load(self, key, count=False):
+        # Stored Chat for `key` from memory or disk, or None; with `count`
+        # the lookup adds to the hit / disk hit counters
+        with self._lock:
+            if key in self._entries:
+                self.hits += count
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        chat = self._read(key) if self.cache_dir else None
+        if chat is not None:
+            with self._lock:
+                self.disk_hits += count
+                self._put(key, chat)
+            return chat
+        return None
+
+    def _base(self, raw):
+        # Largest stored export that `raw` starts with, as (record, Chat)
+        if len(raw) <= PREFIX_SIZE:
+            return None, None
+        prefix = content_hash(raw[:PREFIX_SIZE])
+        view = memoryview(raw)
+        with self._lock:
+            candidates = [(record['size'], key) for key, record in self._records.items()
+                          if record['prefix'] == prefix and record['size'] < len(raw)]
+        for size, key in sorted(candidates, reverse=True):
+            if content_hash(view[:size]) == key:
+                chat = self._load(key)
+                if chat is not None:
+                    return self._records[key], chat
+        return None, None
+
+    def _store(self, key, raw, chat, chat_format):
+        # A chat sorted out of file order has no "last row" to re-parse from,
+        # so it gets no record and is never extended
+        record = {
+            'size': len(raw),
+            'prefix': content_hash(raw[:PREFIX_SIZE]),
+            'last_start': last_message_start(raw, chat_format),
+            'chat_format': chat_format,
+        } if raw is not None and len(raw) > PREFIX_SIZE and not chat.df.attrs.get('reordered') else None
+
+        with self._lock:
+            self._put(key, chat)
+            if record:
+                self._records[key] = record
+        if self.cache_dir:
+            self._write(self._path(key), lambda path: chat.df.to_parquet(path, index=False))
+            if record:
+                self._write(self._path(key, 'json'), lambda path: self._write_record(path, record))
+            self._evict_disk(keep=key)
+
+    def _put(self, key, chat):
+        self._entries[key] = chat
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            if not self.cache_dir:
+                # Without a disk copy an evicted export cannot be extended
+                self._records.pop(evicted, None)
+
+    def get(self, raw, parse=parse_bytes, key=None) -> Chat:
+        # `key` is content_hash(raw) when the caller already has it
+        if key is None:
+            key = content_hash(raw)
+
+        chat = self._load(key, count=True)
+        if chat is not None:
+            return chat
+
+        record, base = self._base(raw)
+        if base is not None:
+            # Re-parse from the stored last message, which may have been cut short
+            chat_format = record['chat_format']
+            tail = parse(memoryview(raw)[record['last_start']:], chat_format=chat_format)
+            chat = base.extend(tail, drop_last=1)
+            with self._lock:
+                self.extends += 1
+        else:
+            df = parse(raw)
+            chat_format = df.attrs.get('chat_format', pre.DEFAULT_FORMAT)
+            chat = Chat(df)
+            with self._lock:
+                self.misses += 1
+
+        self._store(key, raw, chat, chat_format)
+        return chat
+
+    def get_export(self, export) -> Chat:
+        """
+        Chat of an ingest.Export. Exports whose bytes are at hand (uploads,
+        local files) go through get(); zip members are only streamed, so they
+        are cached by key but never extended incrementally.
+        """
+        if export.raw is not None:
+            return self.get(export.raw, key=export.key)
+
+        chat = self._load(export.key, count=True)
+        if chat is not None:
+            return chat
+
+        df = export.parse()
+        chat = Chat(df)
+        with self._lock:
+            self.misses += 1
+        self._store(export.key, None, chat, df.attrs.get('chat_format', pre.DEFAULT_FORMAT))
+        return chat
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if not self.cache_dir:
+                self._records.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'extends': self.extends,
+            'entries': len(self._entries),
+        }
+
+
+class FigureCache:
+    """
+    Rendered charts as PNG bytes, keyed by (chat hash, user, chart id, theme).
+    A hit returns the stored bytes without touching matplotlib; on a miss
+    `render()` builds the figure, which is saved and released right away.
+    Least recently used PNGs are evicted once the total exceeds `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_FIGURE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key, render) -> bytes:
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        fig = render()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', dpi=min(FIGURE_DPI, FIGURE_MAX_WIDTH / fig.get_figwidth()), bbox_inches='tight')
+        # Drop the artists now rather than whenever the figure is collected
+        fig.clear()
+        png = buffer.getvalue()
+
+        with self._lock:
+            self.misses += 1
+            if key not in self._entries:
+                self._entries[key] = png
+                self.size += len(png)
+            # The newest PNG is kept even if it alone exceeds max_bytes
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+        return png
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'bytes': self.size,
+        }
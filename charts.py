@@ -0,0 +1,115 @@
+"""
+Matplotlib / seaborn charts of the dashboard.
+
+Figures are built with the object-oriented API (matplotlib.figure.Figure),
+so they are never registered with pyplot and are freed as soon as the PNG
+has been rendered; see cache.FigureCache.
+"""
+import matplotlib
+from matplotlib.figure import Figure
+import seaborn as sns
+
+
+# Part of every figure cache key, so a style change never serves stale PNGs
+THEME = 'dark_background'
+
+
+def apply_theme():
+    sns.set_style("whitegrid")
+    matplotlib.rcParams.update({'font.family': 'sans-serif'})
+    matplotlib.style.use(THEME)
+
+
+def _bar_labels(ax, bars):
+    for bar in bars:
+        height = bar.get_height()
+        ax.text(bar.get_x() + bar.get_width() / 2, height + 2, f'{height}',
+                ha='center', va='bottom', fontsize=10)
+
+
+def busy_users(busy_user_df) -> Figure:
+    colors = sns.color_palette("coolwarm", len(busy_user_df[:10]))
+
+    fig = Figure()
+    ax = fig.subplots()
+
+    users = list(reversed(busy_user_df['user'][:10]))
+    counts = list(reversed(busy_user_df['count'][:10]))
+
+    bars = ax.barh(users, counts, color=colors)
+
+    for bar in bars:
+        width = bar.get_width()
+        ax.text(width + 1, bar.get_y() + bar.get_height() / 2, f'{width}', va='center', fontsize=10, color='black')
+
+    ax.set_xlabel("Number of Messages", fontsize=12, labelpad=10)
+    ax.set_ylabel("Users", fontsize=12, labelpad=10)
+    ax.set_title("Most Active Users", fontsize=14, weight='bold', color='#fff')
+
+    sns.despine(ax=ax, left=False, bottom=False)
+
+    ax.set_xlim([0, max(counts) + max(counts) * 0.2])
+
+    fig.tight_layout()
+    return fig
+
+
+def wordcloud(wordcloud) -> Figure:
+    fig = Figure()
+    ax = fig.subplots()
+    ax.imshow(wordcloud, interpolation='bilinear')
+    ax.axis('off')
+    fig.tight_layout()
+    return fig
+
+
+def _counts_bar(labels, counts, xlabel, title) -> Figure:
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    colors = sns.color_palette("Spectral", len(labels))
+
+    bars = ax.bar(list(reversed(labels)), list(reversed(counts)), color=colors)
+    _bar_labels(ax, bars)
+
+    ax.set_xlabel(xlabel, fontsize=12, labelpad=10)
+    ax.set_ylabel("Number of Messages", fontsize=12, labelpad=10)
+    ax.set_title(title, fontsize=14, weight='bold', color='#fff')
+
+    sns.despine(ax=ax)
+    ax.tick_params(axis='x', labelrotation=45)
+    fig.tight_layout()
+    return fig
+
+
+def busy_weeks(busy_week_df) -> Figure:
+    return _counts_bar(list(busy_week_df['week']), list(busy_week_df['count']), "Week", "🕒 Messages per Week")
+
+
+def busy_hours(busy_hour_df) -> Figure:
+    return _counts_bar(list(busy_hour_df['busy_hour']), list(busy_hour_df['message']), "Hour", "🕒 Messages per Hour")
+
+
+def activity_heatmap(heatmap_data) -> Figure:
+    fig = Figure(figsize=(12, 6))
+    ax = fig.subplots()
+    sns.heatmap(
+        heatmap_data,
+        linewidths=0.5,
+        linecolor='gray',
+        annot=True,
+        fmt='.0f',
+        annot_kws={"size": 8},
+        ax=ax
+    )
+    ax.set_xlabel("Hour", fontsize=10)
+    ax.set_ylabel("Day", fontsize=10)
+    ax.set_title("User Activity Heatmap", fontsize=14, weight='bold', color='#fff')
+
+    ax.set_xticks([i + 0.5 for i in range(len(heatmap_data.columns))])
+    ax.set_xticklabels([column[1] for column in heatmap_data.columns], rotation=45, fontsize=9)
+
+    ax.set_yticks([i + 0.5 for i in range(len(heatmap_data.index))])
+    ax.set_yticklabels([index[:3] for index in heatmap_data.index], rotation=0, fontsize=9)
+
+    fig.tight_layout()
+    return fig
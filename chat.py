@@ -0,0 +1,234 @@
+import threading
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+import preprocessing as pre
+
+
+def to_epoch(when) -> int:
+    # Seconds since 1970-01-01 of a date / datetime / string, as in the `epoch` column
+    return pd.Timestamp(when).value // 10**9
+
+
+class Chat:
+    """
+    A parsed chat frame plus a user -> row positions index built once.
+    Selecting one participant then costs O(rows of that user) instead of a
+    string comparison over every row. Rows are sorted by `epoch`, so a time
+    range is a binary search (see between()).
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self._index = df.groupby('user', observed=True, sort=False).indices
+        self._lock = threading.Lock()
+        # One lock per derived name, so different values build concurrently
+        self._locks = {}
+        self._derived = {}
+        # name -> compute / (compute, merge), replayed on the new rows by extend
+        self._row_computes = {}
+        self._mergers = {}
+        # Number of derived values built so far; unchanged across a call means it was served from cache
+        self.computed = 0
+
+    def __len__(self):
+        return len(self.df)
+
+    @property
+    def users(self):
+        return list(self._index)
+
+    def _lock_for(self, name: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def row_values(self, name: str, compute) -> np.ndarray:
+        # Per-message values (e.g. sentiment scores) computed once per chat,
+        # aligned with the rows. They are kept next to the frame, never added
+        # to it: other threads and sessions read the frame concurrently.
+        with self._lock_for(name):
+            self._row_computes[name] = compute
+        return self.derived(name, compute)
+
+    def derived(self, name: str, compute, merge=None):
+        # Any other per-chat structure (word / emoji counters, ...) built once.
+        # With `merge(value, added, removed)` the value survives extend().
+        with self._lock_for(name):
+            if name not in self._derived:
+                self._derived[name] = compute(self)
+                self.computed += 1
+            if merge is not None:
+                self._mergers[name] = (compute, merge)
+        return self._derived[name]
+
+    def extend(self, tail: pd.DataFrame, drop_last: int = 0) -> 'Chat':
+        """
+        A new Chat with the last `drop_last` rows replaced by the parsed
+        `tail` rows. Row values are computed for the tail only, and the
+        activity cube and mergeable derived values are updated from the
+        added and removed rows instead of being rebuilt from scratch; other
+        derived values are recomputed on demand. This chat is left untouched.
+        """
+        keep = len(self.df) - drop_last
+        added = Chat(tail)
+        removed = Chat(self.df.iloc[keep:].reset_index(drop=True))
+
+        # Columns the tail does not have (e.g. loaded from disk) are dropped
+        stale = self.df.columns.difference(added.df.columns)
+        # The tail only needs sorting in when it starts before the kept rows end
+        combined = pre.concat_frames([self.df.iloc[:keep].drop(columns=stale), added.df])
+        chat = Chat(pre.sort_by_time(combined))
+        # The permutation sort_by_time applied, if any, moves the row values too
+        order = None if chat.df is combined else np.argsort(combined['epoch'].to_numpy(), kind='stable')
+
+        chat._row_computes = dict(self._row_computes)
+        for name, compute in self._row_computes.items():
+            if name in self._derived:
+                values = np.concatenate([self._derived[name][:keep], added.row_values(name, compute)])
+                chat._derived[name] = values if order is None else values[order]
+
+        if 'cube' in self._derived:
+            chat._derived['cube'] = self.cube.merge(chat, added.cube, removed.cube)
+        for name, (compute, merge) in self._mergers.items():
+            if name in self._derived:
+                chat._derived[name] = merge(self._derived[name], compute(added), compute(removed))
+                chat._mergers[name] = (compute, merge)
+        return chat
+
+    @cached_property
+    def user_codes(self) -> np.ndarray:
+        # Position of each row's user in `users`
+        codes = np.zeros(len(self.df), dtype=np.int32)
+        for code, positions in enumerate(self._index.values()):
+            codes[positions] = code
+        return codes
+
+    @property
+    def cube(self) -> 'ActivityCube':
+        return self.derived('cube', ActivityCube)
+
+    @cached_property
+    def epochs(self) -> np.ndarray:
+        return self.df['epoch'].to_numpy()
+
+    def time_slice(self, start=None, end=None) -> slice:
+        # Rows sent from `start` (inclusive) to `end` (exclusive); None is open
+        lo = 0 if start is None else int(np.searchsorted(self.epochs, to_epoch(start), side='left'))
+        hi = len(self.df) if end is None else int(np.searchsorted(self.epochs, to_epoch(end), side='left'))
+        return slice(lo, max(lo, hi))
+
+    def between(self, start=None, end=None) -> 'Chat':
+        """
+        Chat of the messages sent from `start` (inclusive) to `end`
+        (exclusive), found in O(log n). The rows share this chat's data, and
+        for whole-day bounds the activity cube is a slice of this chat's cube.
+        """
+        rows = self.time_slice(start, end)
+        if rows == slice(0, len(self.df)):
+            return self
+        df = self.df.iloc[rows].copy(deep=False)
+        df.index = pd.RangeIndex(len(df))
+        chat = Chat(df)
+        chat._row_computes = dict(self._row_computes)
+        for name in self._row_computes:
+            if name in self._derived:
+                chat._derived[name] = self._derived[name][rows]
+        whole_days = all(when is None or pd.Timestamp(when) == pd.Timestamp(when).normalize() for when in (start, end))
+        if whole_days and 'cube' in self._derived:
+            chat._derived['cube'] = self.cube.between(chat, start, end)
+        return chat
+
+    def positions(self, selected_user: str) -> np.ndarray:
+        if selected_user == 'All':
+            return np.arange(len(self.df))
+        return self._index.get(selected_user, np.empty(0, dtype=np.intp))
+
+    def for_user(self, selected_user: str) -> pd.DataFrame:
+        if selected_user == 'All':
+            return self.df
+        return self.df.take(self.positions(selected_user))
+
+    def iter_users(self, selected_user: str = 'All'):
+        # (user, frame) for every participant, or just the selected one
+        for user in self._index:
+            if selected_user in ('All', user):
+                yield user, self.for_user(user)
+
+
+def _count_dtype(max_count):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_count <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+class ActivityCube:
+    """
+    Message counts per (user, day, hour of day) computed in one pass over the
+    chat. Every activity view (months, weekdays, weeks, hours, heatmap,
+    history, averages) is a reduction of the (days, 24) slice of one user, or
+    of the precomputed total for 'All'.
+    """
+
+    def __init__(self, chat: Chat):
+        df = chat.df
+        day_codes, days = pd.factorize(df['date'], sort=True)
+        hours = df['hour'].to_numpy() % 12 + 12 * (df['meridiem'] == 'PM').to_numpy()
+        n_users, n_days = len(chat.users), len(days)
+
+        flat = (chat.user_codes.astype(np.int64) * n_days + day_codes) * 24 + hours
+        counts = np.bincount(flat, minlength=n_users * n_days * 24)
+        self._set(chat.users, pd.DatetimeIndex(days), counts.reshape(n_users, n_days, 24))
+
+    def _set(self, users, days: pd.DatetimeIndex, counts: np.ndarray):
+        self.users = users
+        self._user_positions = {user: i for i, user in enumerate(users)}
+        self.counts = counts.astype(_count_dtype(counts.max(initial=0)))
+        self.total = self.counts.sum(axis=0, dtype=np.int64)
+        self.days = pd.DataFrame({
+            'date': days,
+            'year': days.year,
+            'month': days.month,
+            'day': days.day,
+            'week': days.isocalendar().week.to_numpy().astype(np.int8),
+            'day_name': pd.Categorical.from_codes(days.dayofweek, categories=pre.DAY_NAMES, ordered=True),
+        })
+
+    def merge(self, chat: Chat, added: 'ActivityCube', removed: 'ActivityCube') -> 'ActivityCube':
+        # Cube of `chat` from this cube plus / minus the cubes of the rows
+        # extend() added and removed, aligned on users and days
+        days = pd.DatetimeIndex(self.days['date']).union(pd.DatetimeIndex(added.days['date']))
+        positions = {user: i for i, user in enumerate(chat.users)}
+        counts = np.zeros((len(chat.users) + 1, len(days), 24), dtype=np.int64)
+
+        for cube, sign in ((self, 1), (added, 1), (removed, -1)):
+            # Users no longer in the chat land in a scratch row that is dropped
+            rows = [positions.get(user, len(chat.users)) for user in cube.users]
+            columns = days.get_indexer(pd.DatetimeIndex(cube.days['date']))
+            counts[np.ix_(rows, columns)] += sign * cube.counts.astype(np.int64)
+
+        counts = counts[:-1]
+        active = counts.any(axis=(0, 2))
+        cube = ActivityCube.__new__(ActivityCube)
+        cube._set(chat.users, days[active], counts[:, active])
+        return cube
+
+    def between(self, chat: Chat, start=None, end=None) -> 'ActivityCube':
+        # Cube of `chat`, the rows of this cube's chat from day `start` to day `end` (exclusive)
+        dates = pd.DatetimeIndex(self.days['date'])
+        lo = 0 if start is None else dates.searchsorted(pd.Timestamp(start))
+        hi = len(dates) if end is None else dates.searchsorted(pd.Timestamp(end))
+        rows = [self._user_positions[user] for user in chat.users]
+        cube = ActivityCube.__new__(ActivityCube)
+        cube._set(chat.users, dates[lo:hi], self.counts[rows, lo:hi])
+        return cube
+
+    def for_user(self, selected_user: str) -> np.ndarray:
+        if selected_user == 'All':
+            return self.total
+        position = self._user_positions.get(selected_user)
+        if position is None:
+            return np.zeros_like(self.total)
+        return self.counts[position].astype(np.int64)
@@ -0,0 +1,218 @@
+"""
+Headless batch analysis of WhatsApp exports.
+
+    python cli.py EXPORT [EXPORT ...] --output DIR [--workers N] [--format json|parquet] [--skip TABLE ...] [--approximate]
+
+Each EXPORT is a .txt or .zip file, a directory (its *.txt and *.zip files)
+or a glob pattern. Chats are analyzed on a process pool of --workers
+processes, one chat per process at a time. For every chat DIR/<chat name>/ receives summary.json (per-user
+stats and averages) plus one table per aggregate, with a `user` column where
+the table is computed per participant. With --approximate the word / emoji
+rankings and the distinct word / link counts come from fixed-size sketches
+(see sketches.py). Streamlit is never imported.
+"""
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import dynamics
+import ingest
+import profiling
+import utils
+from chat import Chat
+
+
+# Names of the values dynamics.session_stats returns, in order
+SESSION_NAMES = ['sessions', 'median_minutes', 'median_messages', 'average_participants']
+
+# Tables computed for 'All' and every participant, stacked with a `user` column
+PER_USER_TABLES = {
+    'busy_months': utils.most_busy_month,
+    'busy_days': utils.most_busy_day,
+    'busy_weeks': utils.most_busy_week,
+    'busy_hours': utils.most_busy_hour,
+    'history': utils.get_line_chat_of_message_history,
+    'heatmap': lambda chat, user: utils.heatmap_activity(chat, user).droplevel(0, axis=1).stack().rename('count').reset_index(),
+}
+# Most used words / emojis written per participant
+TOP_TOKENS = 20
+# Tables that already cover every participant
+CHAT_TABLES = ['busy_users', 'words_and_emojis', 'sentiment', 'sentiment_overall', 'mentions', 'sessions', 'starters', 'reply_latency']
+TABLES = list(PER_USER_TABLES) + CHAT_TABLES
+
+EXPORT_EXTENSIONS = ['.txt', '.zip']
+OUTPUT_FORMATS = ['json', 'parquet']
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+
+def find_exports(patterns):
+    """
+    Expand files, directories (their *.txt and *.zip files) and glob patterns into a
+    sorted list of unique export paths.
+    """
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for extension in EXPORT_EXTENSIONS:
+                paths.update(glob.glob(os.path.join(pattern, '*' + extension)))
+        elif os.path.isfile(pattern):
+            paths.add(pattern)
+        else:
+            paths.update(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+    return sorted(paths)
+
+
+def chat_names(paths):
+    # Output directory per export: the file stem, numbered when stems collide
+    names = {}
+    seen = {}
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        seen[stem] = seen.get(stem, 0) + 1
+        names[path] = stem if seen[stem] == 1 else f"{stem}-{seen[stem]}"
+    return names
+
+
+def _write_table(df, path, output_format):
+    if output_format == 'parquet':
+        df.to_parquet(path + '.parquet', index=False)
+    else:
+        df.to_json(path + '.json', orient='records', date_format='iso', force_ascii=False, indent=2)
+
+
+def analyze_chat(chat: Chat, skip=(), approximate=False, sentiment_workers=None):
+    """
+    summary dict and name -> DataFrame tables for one parsed chat.
+    `sentiment_workers` bounds the sentiment scoring pool.
+    """
+    users = ['All'] + chat.users
+    # Unformatted values (the dashboard shows "3.00K"); missing averages become null
+    table = utils.summary_table(chat).astype(object)
+    rows = table.where(table.notna(), None).to_dict(orient='index')
+    summary = {
+        'messages': len(chat),
+        'users': {
+            user: {
+                'stats': {column: rows[user][column] for column in utils.STAT_COLUMNS},
+                'averages': {column: rows[user][column] for column in utils.AVERAGE_COLUMNS},
+                'sessions': dict(zip(SESSION_NAMES, dynamics.session_stats(chat, user))),
+            }
+            for user in users
+        },
+    }
+    summary['approximate'] = approximate
+
+    tables = {}
+    for name, func in PER_USER_TABLES.items():
+        if name not in skip:
+            tables[name] = pd.concat([func(chat, user).assign(user=user) for user in users], ignore_index=True)
+
+    if 'busy_users' not in skip:
+        tables['busy_users'] = utils.most_busy_user(chat, 'All')
+    if 'words_and_emojis' not in skip:
+        tables['words_and_emojis'] = pd.DataFrame(
+            [(user, kind, token, count) for user in users for kind in ('words', 'emojis')
+             for token, count in utils.most_common_tokens(chat, kind, user, TOP_TOKENS, approximate)],
+            columns=['user', 'kind', 'token', 'count'],
+        )
+        summary['distinct_words'], summary['distinct_links'] = utils.distinct_counts(chat, 'All', approximate)
+    if 'sentiment' not in skip:
+        # Counts, 0-1 shares and mood codes (indexes in utils.MOODS)
+        tables['sentiment'] = utils.sentiment_table(chat, 'All', workers=sentiment_workers)
+        moods = tables['sentiment']['mood'].value_counts()
+        tables['sentiment_overall'] = pd.DataFrame({'mood': moods.index, 'users': moods.to_numpy()})
+    if 'mentions' not in skip:
+        mentions = utils.mention_matrix(chat).stack().rename('count').reset_index()
+        tables['mentions'] = mentions[mentions['count'] > 0].reset_index(drop=True)
+        summary['most_mentioned'] = utils.get_most_mentioned_users(chat, 'All')
+    if 'sessions' not in skip:
+        tables['sessions'] = dynamics.conversation_sessions(chat)
+    if 'starters' not in skip:
+        tables['starters'] = dynamics.conversation_starters(chat)
+    if 'reply_latency' not in skip:
+        tables['reply_latency'] = dynamics.reply_latency(chat, 'All')
+    return summary, tables
+
+
+def process_export(path, output_dir, output_format='json', skip=(), approximate=False):
+    """
+    Parse and analyze one export and write its outputs to `output_dir`.
+    Runs in a worker process; failures are reported, not raised, so one bad
+    export does not stop the batch.
+    """
+    start = time.perf_counter()
+    result = {'path': path, 'output': output_dir, 'bytes': os.path.getsize(path)}
+    try:
+        # Zips are streamed and large text files memory-mapped, so a worker
+        # never holds the raw export and its decoded text at once
+        with ingest.from_path(path) as export, profiling.MemoryTracker() as memory:
+            chat = Chat(export.parse())
+        result['peak_bytes'] = memory.peak_delta
+        # The batch already runs one chat per process, so scoring stays in-process
+        summary, tables = analyze_chat(chat, skip, approximate, sentiment_workers=1)
+
+        os.makedirs(output_dir, exist_ok=True)
+        summary = {'source': os.path.abspath(path), 'chat_format': chat.df.attrs.get('chat_format'), **summary}
+        with open(os.path.join(output_dir, 'summary.json'), 'w', encoding='utf-8') as file:
+            json.dump(summary, file, ensure_ascii=False, indent=2)
+        for name, df in tables.items():
+            _write_table(df, os.path.join(output_dir, name), output_format)
+
+        result['messages'] = len(chat)
+        result['users'] = len(chat.users)
+    except Exception as error:
+        result['error'] = f"{type(error).__name__}: {error}"
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def run_batch(paths, output, workers=DEFAULT_WORKERS, output_format='json', skip=(), approximate=False):
+    names = chat_names(paths)
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(process_export, path, os.path.join(output, names[path]), output_format, skip, approximate) for path in paths]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if 'error' in result:
+                print(f"FAILED {result['path']}: {result['error']}", file=sys.stderr)
+            else:
+                peak = f", peak +{result['peak_bytes'] / 2**20:.1f} MiB" if result.get('peak_bytes') is not None else ''
+                print(f"{result['path']}: {result['messages']:,} messages, {result['users']} users in {result['seconds']:.2f} s{peak}")
+
+    seconds = time.perf_counter() - start
+    done = [result for result in results if 'error' not in result]
+    messages = sum(result['messages'] for result in done)
+    size = sum(result['bytes'] for result in done)
+    print(f"{len(done)}/{len(results)} chats, {messages:,} messages, {size / 2**20:.1f} MiB in {seconds:.2f} s "
+          f"({messages / seconds:,.0f} msg/s, {size / 2**20 / seconds:.1f} MiB/s, {workers} workers)")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyze WhatsApp chat exports without the dashboard.')
+    parser.add_argument('exports', nargs='+', help='export files, directories or glob patterns')
+    parser.add_argument('-o', '--output', required=True, help='directory receiving one folder per chat')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS, help='chats analyzed at the same time')
+    parser.add_argument('-f', '--format', choices=OUTPUT_FORMATS, default='json', help='format of the tables')
+    parser.add_argument('--skip', nargs='+', choices=TABLES, default=[], help='tables not to compute (e.g. sentiment)')
+    parser.add_argument('--approximate', action='store_true', help='fixed-memory sketches for word / emoji rankings and distinct counts')
+    args = parser.parse_args(argv)
+
+    paths = find_exports(args.exports)
+    if not paths:
+        parser.error('no exports found')
+
+    results = run_batch(paths, args.output, max(1, args.workers), args.format, set(args.skip), args.approximate)
+    return 1 if any('error' in result for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
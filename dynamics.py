@@ -0,0 +1,208 @@
+"""
+Conversation dynamics: reply latency, sessions and who starts / ends them.
+
+Everything is computed from two arrays of the time-sorted chat, the message
+epochs and the user codes, with NumPy diff / cumsum / bincount and radix
+sorts, so each metric is a few vectorized passes even over
+multi-million-message chats. System notices take no part in conversations.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import preprocessing as pre
+from chat import Chat
+
+
+# A silence longer than this (in seconds) starts a new conversation session
+SESSION_GAP = 60 * 60
+# Per-gap arrays are as long as the chat, so each chat keeps them for its
+# CACHED_GAPS most recently used gaps only
+CACHED_GAPS = 2
+
+_gaps_lock = threading.Lock()
+
+
+def _as_chat(df: pd.DataFrame | Chat) -> Chat:
+    return df if isinstance(df, Chat) else Chat(df)
+
+
+def _conversation(chat: Chat):
+    # (epochs, user codes) of the messages written by participants
+    epochs, codes = chat.epochs, chat.user_codes
+    if pre.SYSTEM_USER in chat.users:
+        written = codes != chat.users.index(pre.SYSTEM_USER)
+        epochs, codes = epochs[written], codes[written]
+    return epochs, codes
+
+
+def _group_order(codes: np.ndarray, n_users: int) -> np.ndarray:
+    # Stable order of the rows grouped by user; NumPy radix-sorts 16-bit keys in O(n)
+    if n_users <= np.iinfo(np.uint16).max:
+        codes = codes.astype(np.uint16)
+    return np.argsort(codes, kind='stable')
+
+
+def _sessions(chat: Chat, gap: int) -> dict:
+    epochs, codes = chat.derived('conversation', _conversation)
+    opens = np.r_[True, np.diff(epochs) > gap] if len(epochs) else np.zeros(0, dtype=bool)
+    starts = np.flatnonzero(opens)
+    return {
+        'epochs': epochs,
+        'codes': codes,
+        # Session of every message, and the first / last message of every session
+        'session': np.cumsum(opens) - 1,
+        'starts': starts,
+        'ends': np.r_[starts[1:], len(epochs)][:len(starts)] - 1,
+    }
+
+
+def _members(chat: Chat, gap: int):
+    # (session, user code) of every participation. A row is a user's first
+    # in its session when that user's previous row (in time, found through
+    # the grouped order) is in an earlier session.
+    sessions = _sessions_of(chat, gap)
+    order = _group_order(sessions['codes'], len(chat.users))
+    grouped_codes, grouped_sessions = sessions['codes'][order], sessions['session'][order]
+    first = np.r_[True, (grouped_codes[1:] != grouped_codes[:-1]) | (grouped_sessions[1:] != grouped_sessions[:-1])] if len(order) else np.zeros(0, dtype=bool)
+    return grouped_sessions[first], grouped_codes[first]
+
+
+def _for_gap(chat: Chat, name: str, gap: int, compute):
+    # compute(chat, gap), cached on the chat with the values of its other
+    # recently used gaps; the least recently used gap is evicted
+    gaps = chat.derived('gaps', lambda chat: OrderedDict())
+    with _gaps_lock:
+        values = gaps.pop(gap, {})
+        gaps[gap] = values
+        while len(gaps) > CACHED_GAPS:
+            gaps.popitem(last=False)
+    if name not in values:
+        values.setdefault(name, compute(chat, gap))
+        chat.computed += 1
+    return values[name]
+
+
+def _sessions_of(chat: Chat, gap: int) -> dict:
+    # Session arrays for an inactivity threshold of `gap` seconds
+    return _for_gap(chat, 'sessions', gap, _sessions)
+
+
+def _members_of(chat: Chat, gap: int):
+    return _for_gap(chat, 'members', gap, _members)
+
+
+def conversation_sessions(df: pd.DataFrame | Chat, gap: int = SESSION_GAP) -> pd.DataFrame:
+    """
+    One row per conversation session: start and end time, length in
+    minutes, messages, distinct participants and who started / ended it.
+    """
+    chat = _as_chat(df)
+    sessions = _sessions_of(chat, gap)
+    epochs, codes, starts, ends = sessions['epochs'], sessions['codes'], sessions['starts'], sessions['ends']
+    return pd.DataFrame({
+        'start': pd.to_datetime(epochs[starts], unit='s'),
+        'end': pd.to_datetime(epochs[ends], unit='s'),
+        'minutes': (epochs[ends] - epochs[starts]) / 60,
+        'messages': ends - starts + 1,
+        'participants': np.bincount(_members_of(chat, gap)[0], minlength=len(starts)),
+        'starter': pd.Categorical.from_codes(codes[starts], categories=chat.users),
+        'ender': pd.Categorical.from_codes(codes[ends], categories=chat.users),
+    })
+
+
+def session_stats(df: pd.DataFrame | Chat, selected_user: str, gap: int = SESSION_GAP):
+    """
+    Number of sessions the selected user took part in, their median length
+    in minutes and median messages, and the average number of participants.
+    """
+    chat = _as_chat(df)
+    sessions = _sessions_of(chat, gap)
+    starts, ends = sessions['starts'], sessions['ends']
+    member_sessions, member_codes = _members_of(chat, gap)
+    taken = np.arange(len(starts))
+    if selected_user != 'All':
+        code = chat.users.index(selected_user) if selected_user in chat.users else -1
+        taken = member_sessions[member_codes == code]
+    if not len(taken):
+        return 0, 0.0, 0, 0.0
+
+    epochs = sessions['epochs']
+    participants = np.bincount(member_sessions, minlength=len(starts))
+    return (
+        len(taken),
+        round(float(np.median(epochs[ends[taken]] - epochs[starts[taken]])) / 60, 1),
+        int(np.median(ends[taken] - starts[taken] + 1)),
+        round(float(participants[taken].mean()), 2),
+    )
+
+
+def conversation_starters(df: pd.DataFrame | Chat, gap: int = SESSION_GAP) -> pd.DataFrame:
+    """
+    Per participant: sessions taken part in, started and ended, with the
+    share of their sessions they started; most frequent starters first.
+    """
+    chat = _as_chat(df)
+    sessions = _sessions_of(chat, gap)
+    n_users = len(chat.users)
+    joined = np.bincount(_members_of(chat, gap)[1], minlength=n_users)
+    started = np.bincount(sessions['codes'][sessions['starts']], minlength=n_users)
+    ended = np.bincount(sessions['codes'][sessions['ends']], minlength=n_users)
+
+    table = pd.DataFrame({'user': chat.users, 'sessions': joined, 'started': started, 'ended': ended})
+    table['start_share'] = (table['started'] / table['sessions'].clip(lower=1) * 100).round(1)
+    table = table[table['sessions'] > 0]
+    return table.sort_values(['started', 'sessions'], ascending=False, kind='stable', ignore_index=True)
+
+
+def _replies(chat: Chat, gap: int):
+    # (replier codes, replied-to codes, latencies in seconds) of every change
+    # of speaker within a session
+    epochs, codes = chat.derived('conversation', _conversation)
+    replies = np.flatnonzero((codes[1:] != codes[:-1]) & (np.diff(epochs) <= gap)) + 1
+    return codes[replies], codes[replies - 1], epochs[replies] - epochs[replies - 1]
+
+
+def _group_medians(groups: np.ndarray, values: np.ndarray, n_groups: int) -> np.ndarray:
+    # Median of the non-negative `values` of each group from a single sort of
+    # (group, value) packed into one int64 key; NaN for empty groups
+    counts = np.bincount(groups, minlength=n_groups)
+    keys = np.sort((groups.astype(np.int64) << 32) | values.astype(np.int64))
+    offsets = np.r_[0, np.cumsum(counts)[:-1]]
+    medians = np.full(n_groups, np.nan)
+    filled = counts > 0
+    sorted_values = keys & 0xFFFFFFFF
+    low = sorted_values[offsets[filled] + (counts[filled] - 1) // 2]
+    high = sorted_values[offsets[filled] + counts[filled] // 2]
+    medians[filled] = (low + high) / 2
+    return medians
+
+
+def reply_latency(df: pd.DataFrame | Chat, selected_user: str = 'All', gap: int = SESSION_GAP) -> pd.DataFrame:
+    """
+    How fast participants answer each other. A reply is a message whose
+    author differs from the previous message's, within one session. For
+    'All' there is one row per replier; for a user, one row per participant
+    that user replied to. Latencies are in minutes.
+    """
+    chat = _as_chat(df)
+    repliers, replied, latencies = _for_gap(chat, 'replies', gap, _replies)
+    groups = repliers
+    if selected_user != 'All':
+        code = chat.users.index(selected_user) if selected_user in chat.users else -1
+        mine = repliers == code
+        groups, latencies = replied[mine], latencies[mine]
+
+    n_users = len(chat.users)
+    counts = np.bincount(groups, minlength=n_users)
+    totals = np.bincount(groups, weights=latencies, minlength=n_users)
+    table = pd.DataFrame({
+        'user': chat.users,
+        'replies': counts,
+        'median_minutes': (_group_medians(groups, latencies, n_users) / 60).round(1),
+        'mean_minutes': (totals / np.maximum(counts, 1) / 60).round(1),
+    })
+    table = table[table['replies'] > 0]
+    return table.sort_values('median_minutes', kind='stable', ignore_index=True)
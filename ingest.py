@@ -0,0 +1,136 @@
+"""
+Turning uploads and local files into parseable exports.
+
+WhatsApp exports are either the chat text itself or a .zip holding the chat
+text next to the shared media. Zip members are decompressed as a stream into
+the parser's incremental decoder; media members are never read. Local files
+of at least MMAP_MIN_SIZE bytes are memory-mapped rather than read into
+memory.
+"""
+import os
+import mmap
+import zipfile
+
+import preprocessing as pre
+from cache import content_hash
+
+
+ZIP_MAGIC = b'PK\x03\x04'
+MMAP_MIN_SIZE = 64 << 20
+
+
+class Export:
+    """
+    One chat export ready to parse.
+    `key` identifies its content for the parse cache and `open()` returns a
+    fresh stream of the chat text on every call. `raw` is the whole text as
+    a bytes-like object when it is in memory or memory-mapped, and None for
+    zip members, which are only ever streamed.
+    """
+
+    def __init__(self, name, key, open, size, raw=None, close=None):
+        self.name = name
+        self.key = key
+        self.open = open
+        self.size = size
+        self.raw = raw
+        self._close = close
+
+    def parse(self, chat_format=None):
+        return pre.preprocess_source(self.open, chat_format=chat_format)
+
+    def close(self):
+        if self._close is not None:
+            self._close()
+            self._close = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _release(close):
+    # A view still exported from the buffer (e.g. by a parse that raised
+    # halfway) makes closing fail; the buffer is then freed with that view
+    def release():
+        try:
+            close()
+        except BufferError:
+            pass
+    return release
+
+
+def chat_member(archive: zipfile.ZipFile) -> zipfile.ZipInfo:
+    """
+    The chat text of an exported zip: '_chat.txt' on iOS, 'WhatsApp Chat
+    with <name>.txt' on Android, otherwise the largest .txt member.
+    """
+    members = [info for info in archive.infolist() if not info.is_dir() and info.filename.lower().endswith('.txt')]
+    if not members:
+        raise ValueError('The zip file does not contain a chat export (.txt)')
+    for info in members:
+        base = os.path.basename(info.filename).lower()
+        if base == '_chat.txt' or base.startswith('whatsapp chat'):
+            return info
+    return max(members, key=lambda info: info.file_size)
+
+
+def _iter_member(archive, member):
+    with archive.open(member) as file:
+        while True:
+            chunk = file.read(pre.STREAM_READ_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def from_zip(file, name=None) -> Export:
+    # `file` is a path or a seekable binary file object
+    archive = zipfile.ZipFile(file)
+    member = chat_member(archive)
+    # The central directory already has the member's CRC and size, so the
+    # key costs nothing; hashing the text would mean decompressing it twice
+    key = content_hash(f"zip:{member.filename}:{member.CRC:08x}:{member.file_size}".encode('utf-8'))
+    return Export(name or member.filename, key, lambda: _iter_member(archive, member), member.file_size, close=archive.close)
+
+
+def from_buffer(buffer, name=None, close=None) -> Export:
+    return Export(name, content_hash(buffer), lambda: pre.iter_buffer(buffer), len(buffer), raw=buffer, close=close)
+
+
+def from_upload(uploaded_file) -> Export:
+    """
+    Export of an uploaded file object (e.g. Streamlit's UploadedFile, an
+    in-memory BytesIO). Plain text is used through a view of the upload's
+    buffer, without copying it.
+    """
+    name = getattr(uploaded_file, 'name', None)
+    buffer = uploaded_file.getbuffer()
+    if buffer[:len(ZIP_MAGIC)] == ZIP_MAGIC:
+        buffer.release()
+        uploaded_file.seek(0)
+        return from_zip(uploaded_file, name)
+    return from_buffer(buffer, name, close=_release(buffer.release))
+
+
+def from_path(path, mmap_min_size=MMAP_MIN_SIZE) -> Export:
+    """
+    Export of a local .txt or .zip file. Text files of at least
+    `mmap_min_size` bytes are memory-mapped; smaller ones are read whole.
+    """
+    name = os.path.basename(path)
+    with open(path, 'rb') as file:
+        is_zip = file.read(len(ZIP_MAGIC)) == ZIP_MAGIC
+    if is_zip:
+        return from_zip(path, name)
+
+    size = os.path.getsize(path)
+    if size < mmap_min_size or size == 0:
+        with open(path, 'rb') as file:
+            return from_buffer(file.read(), name)
+
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return from_buffer(mapped, name, close=_release(mapped.close))
@@ -1,41 +1,193 @@
+import os
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import streamlit as st
-import seaborn as sns
-import preprocessing as pre
 import utils
+import dynamics
+import charts
+import ingest
+import profiling
+from cache import FigureCache, ParseCache
 
-sns.set_style("whitegrid")
-plt.rcParams.update({'font.family': 'sans-serif'})
-plt.style.use('dark_background')
+charts.apply_theme()
 
 st.set_page_config(page_title="WhatsApp Data Analysis", layout="wide")
 st.title("WhatsApp Data Analysis App")
 
 
+@st.cache_resource
+def get_parse_cache():
+    # Shared by every session of this process; CHAT_CACHE_DIR enables the
+    # Parquet tier and CHAT_CACHE_DISK_MB bounds its size
+    return ParseCache(
+        max_entries=int(os.environ.get('CHAT_CACHE_ENTRIES', 8)),
+        cache_dir=os.environ.get('CHAT_CACHE_DIR'),
+        max_disk_bytes=int(os.environ.get('CHAT_CACHE_DISK_MB', 1024)) << 20,
+    )
+
+
+parse_cache = get_parse_cache()
+
+
+@st.cache_resource
+def get_figure_cache():
+    # Rendered chart PNGs shared by every session; FIGURE_CACHE_MB bounds the total size
+    return FigureCache(max_bytes=int(os.environ.get('FIGURE_CACHE_MB', 64)) << 20)
+
+
+figure_cache = get_figure_cache()
+
+
+def show_chart(scope, chart_id, render):
+    # Served from the figure cache; matplotlib only runs on a miss
+    key = (*scope, chart_id, charts.THEME)
+    with profiler.span(f"{chart_id} chart", "render") as span:
+        span.cache = 'hit' if key in figure_cache else 'miss'
+        st.image(figure_cache.get(key, render), use_container_width=True)
+
+
+@st.cache_resource
+def preload_models():
+    # Opt-in: load NLP models at startup instead of on first use
+    utils.preload_models()
+
+
+if os.environ.get('PRELOAD_MODELS') == '1':
+    preload_models()
+
+
+@st.cache_resource
+def get_executor():
+    # Section analyses of every session run here while the script thread renders
+    return ThreadPoolExecutor(max_workers=int(os.environ.get('DASHBOARD_WORKERS', 4)), thread_name_prefix='section')
+
+
+executor = get_executor()
+# PREFETCH_SECTIONS=1 also starts the on-demand sections (wordcloud, sentiment, mentions) at upload
+PREFETCH_SECTIONS = os.environ.get('PREFETCH_SECTIONS') == '1'
+
+
+def submit(scope, section, func, *args):
+    """
+    Future of func(*args) for `section` of the current chat and user, kept in
+    session_state so reruns reuse it. Futures of another chat or user are
+    cancelled when the scope changes. The utils calls it makes are recorded
+    on `future.profiler` for result() to merge into the run's spans.
+    """
+    if st.session_state.get('section_scope') != scope:
+        for future in st.session_state.get('section_futures', {}).values():
+            future.cancel()
+        st.session_state['section_scope'] = scope
+        st.session_state['section_futures'] = {}
+    futures = st.session_state['section_futures']
+    if section not in futures:
+        section_profiler = profiling.Profiler()
+        futures[section] = executor.submit(profiling.profiled_by(section_profiler, func), *args)
+        futures[section].profiler = section_profiler
+    return futures[section]
+
+# Every utils call of this run becomes a span; PROFILE_DIR also dumps a
+# cProfile (or PROFILE_ENGINE=pyinstrument) profile of each full rerun
+profiling.instrument(utils)
+profiling.instrument(dynamics)
+profiler = profiling.Profiler()
+profiling.activate(profiler)
+run_profile = None
+if os.environ.get('PROFILE_DIR'):
+    run_profile = profiling.RunProfile.in_directory(os.environ['PROFILE_DIR'], os.environ.get('PROFILE_ENGINE', 'cprofile')).start()
+
 st.sidebar.title("Upload WhatsApp Chat Data")
-uploaded_file = st.sidebar.file_uploader("Upload a file", type=["txt"])
+uploaded_file = st.sidebar.file_uploader("Upload a file", type=["txt", "zip"])
 
 if uploaded_file is not None:
     st.write("File name:", uploaded_file.name)
 
-    binary_file = uploaded_file.getvalue()
-    data = binary_file.decode("utf-8")
-    with st.spinner("Processing data..."):
-        df = pre.preprocess_data(data)
+    # Text uploads are hashed and parsed through a view of the upload buffer;
+    # zipped exports stream the chat member and never read the media
+    export = ingest.from_upload(uploaded_file)
+    chat_key = export.key
+    with st.spinner("Processing data..."), profiler.span("Parsing") as span, profiling.MemoryTracker() as memory:
+        before = parse_cache.stats()
+        chat = parse_cache.get_export(export)
+        cache_stats = parse_cache.stats()
+        span.cache = next((status for status, counter in [('hit', 'hits'), ('disk hit', 'disk_hits'), ('incremental', 'extends'), ('miss', 'misses')]
+                           if cache_stats[counter] > before[counter]), None)
+    export.close()
+
+    # Peak memory of the run that actually parsed this upload
+    ingest_memory = st.session_state.setdefault('ingest_memory', {})
+    if span.cache != 'hit' or chat_key not in ingest_memory:
+        ingest_memory[chat_key] = memory.peak_delta
+
+    st.sidebar.caption(f"Parse cache: {cache_stats['hits']} hits, {cache_stats['disk_hits']} disk hits, {cache_stats['misses']} misses, {cache_stats['extends']} incremental")
+    if ingest_memory[chat_key] is not None:
+        st.sidebar.caption(f"Upload of {export.size / 2**20:.1f} MiB parsed with a peak of +{ingest_memory[chat_key] / 2**20:.1f} MiB")
     
-    user_list = sorted(df['user'].unique().tolist())
+    # Rows are sorted by time, so a date range is a binary search on the
+    # epochs; the range's Chat is kept in session_state while the range stays
+    start, end = None, None
+    if len(chat):
+        first_day, last_day = (pd.Timestamp(epoch, unit='s').date() for epoch in chat.epochs[[0, -1]])
+        date_range = st.sidebar.date_input("Date range", value=(first_day, last_day), min_value=first_day, max_value=last_day, key=f"date_range_{chat_key}")
+        # A single date (the end is still being picked) keeps the whole chat
+        if len(date_range) == 2 and tuple(date_range) != (first_day, last_day):
+            start, end = pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1]) + pd.Timedelta(days=1)
+            if st.session_state.get('range_key') != (chat_key, start, end):
+                st.session_state['range_key'] = (chat_key, start, end)
+                st.session_state['range_chat'] = chat.between(start, end)
+            chat = st.session_state['range_chat']
+
+    # Every stat and average of every participant in one pass; the user
+    # selection below and the comparison view only read rows of it
+    with st.spinner("Summarizing chat..."), profiler.span("Summary table"):
+        utils.summary_table(chat)
+
+    user_list = sorted(chat.users)
     user_list.insert(0, "All")
     selected_user = st.sidebar.selectbox("Choose the User", options= user_list, key="user_select")
+    # Word / emoji rankings, the wordcloud and distinct counts from fixed-size
+    # sketches (sketches.py) instead of exact per-token state
+    approximate = st.sidebar.toggle("Approximate analytics (fixed memory)", value=os.environ.get('APPROXIMATE_ANALYTICS') == '1', key="approximate")
 
     if selected_user:
-        with st.spinner("Analyzing Stats..."):
+        # Independent analyses start on the pool now; each section below waits
+        # for its own result, so charts render while later sections compute.
+        # Stats stay on this thread so the first metrics are not queued.
+        scope = (chat_key, start, end, selected_user, approximate)
+        sections = {
+            'busy_users': utils.most_busy_user,
+            'busy_month': utils.most_busy_month,
+            'busy_day': utils.most_busy_day,
+            'busy_week': utils.most_busy_week,
+            'busy_hour': utils.most_busy_hour,
+            'heatmap': utils.heatmap_activity,
+            'words_and_emojis': functools.partial(utils.most_used_words_and_emojies, approximate=approximate),
+        }
+        on_demand = {
+            'wordcloud': functools.partial(utils.create_wordcloud, approximate=approximate),
+            'sentiment': utils.sentiment_analysis,
+            'mentions': utils.get_most_mentioned_users,
+        }
+        for section, func in {**sections, **(on_demand if PREFETCH_SECTIONS else {})}.items():
+            submit(scope, section, func, chat, selected_user)
+
+        def result(section):
+            future = submit(scope, section, {**sections, **on_demand}[section], chat, selected_user)
+            value = future.result()
+            # The section's spans join the first run that reads it; later reruns reuse its result
+            if future.profiler is not None:
+                profiler.merge(future.profiler)
+                future.profiler = None
+            return value
+
+        with st.spinner("Analyzing Stats..."), profiler.span("Stats"):
             (
                 total_messages, total_words, total_media_messages, total_links,
                 total_characters, average_words, longest_message_length, shortest_message_length,
                 most_active_day, active_days, longest_streak, max_gap
-            ) = utils.stats(df, selected_user)
+            ) = utils.stats(chat, selected_user)
 
             st.markdown("### 🔢 Chat Summary Statistics")
 
@@ -72,9 +224,9 @@ if uploaded_file is not None:
             ################################################################################
             ############################### Line Chart For Messages History#################
             ################################################################################
-        with st.spinner("Calculating Avarages..."):
+        with st.spinner("Calculating Avarages..."), profiler.span("Averages"):
             st.markdown("### 📊 Avarages")
-            month, day, week, hour = utils.get_averages(df, selected_user)
+            month, day, week, hour = utils.get_averages(chat, selected_user)
             
             col1, col2 = st.columns(2)
 
@@ -98,16 +250,34 @@ if uploaded_file is not None:
             with col2:
                 st.markdown(f"#### **{hour}**") 
 
+            ################################################################################
+            ############################### User Comparison ################################
+            ################################################################################
+        with st.spinner("Comparing Users..."), profiler.span("User comparison"):
+            st.markdown("### 👥 Compare Users")
+            st.markdown("Side-by-side stats of the chosen participants.")
+
+            compared_users = st.multiselect("Users to compare", options=user_list, default=user_list[:3], key=f"compare_{chat_key}")
+            if compared_users:
+                st.dataframe(utils.compare_users(chat, compared_users), use_container_width=True)
+
+            st.markdown('---')
+
             ################################################################################
             ############################### Line Chart For Messages History#################
             ################################################################################
             
-        with st.spinner("Loading Line Chart For Messages History..."):
+        with st.spinner("Loading Line Chart For Messages History..."), profiler.span("Message history"):
             
-            line_chart_data = utils.get_line_chat_of_message_history(df, selected_user)        
             st.markdown("### 📈 Message History - Growth")
             st.markdown("This line chart shows the number of messages sent over time.")
-            st.line_chart(data = line_chart_data, x='date', y = 'count', use_container_width=True, x_label="Date", y_label="Number of Messages")   
+            col1, col2 = st.columns(2)
+            freq = col1.radio("Period", options=list(utils.HISTORY_FREQUENCIES), format_func=utils.HISTORY_FREQUENCIES.get, horizontal=True, key="history_freq")
+            window = col2.number_input("Rolling average over periods (0 = off)", min_value=0, max_value=365, value=0, key="history_window")
+
+            # Reduced from the activity cube, cheap enough for the script thread
+            line_chart_data = utils.get_line_chat_of_message_history(chat, selected_user, freq, window)
+            st.line_chart(data = line_chart_data, x='date', y = ['count', 'rolling'] if window else 'count', use_container_width=True, x_label="Date", y_label="Number of Messages")   
             
                 
             
@@ -115,36 +285,14 @@ if uploaded_file is not None:
             ############################### Most Busy Users ################################
             ################################################################################
 
-        with st.spinner("Finding Most Busy Users..."):
+        with st.spinner("Finding Most Busy Users..."), profiler.span("Most busy users"):
                     
-            busy_user_df = utils.most_busy_user(df, selected_user)
-            colors = sns.color_palette("coolwarm", len(busy_user_df[:10]))
-            
-            fig, ax = plt.subplots()
-            
-            users = list(reversed(busy_user_df['user'][:10]))
-            counts = list(reversed(busy_user_df['count'][:10]))
-            
-            bars = ax.barh(users, counts, color=colors)
-            
-            for bar in bars:
-                width = bar.get_width()
-                ax.text(width + 1, bar.get_y() + bar.get_height() / 2, f'{width}', va='center', fontsize=10, color='black')
-
-            ax.set_xlabel("Number of Messages", fontsize=12, labelpad=10)
-            ax.set_ylabel("Users", fontsize=12, labelpad=10)
-            ax.set_title("Most Active Users", fontsize=14, weight='bold', color='#fff')
-
-            sns.despine(left=False, bottom=False)
-
-            ax.set_xlim([0, max(counts) + max(counts) * 0.2])
-
-            plt.tight_layout()
+            busy_user_df = result('busy_users')
             
             col1, col2 = st.columns(2)
             col1.markdown("### 🧑‍💻 Most Busy User")            
             with col1:
-                st.pyplot(fig)
+                show_chart(scope, 'busy_users', lambda: charts.busy_users(busy_user_df))
                 
             with col2:
                 col2.markdown("### 📈 User Message Count")
@@ -156,29 +304,25 @@ if uploaded_file is not None:
             ################################################################################
             ############################### Wordcloud ######################################
             ################################################################################
-        with st.spinner("Creating Wordcloud..."):
+        with st.spinner("Creating Wordcloud..."), profiler.span("Wordcloud"):
 
             st.markdown("### 🗣️ Wordcloud")
             st.markdown("This wordcloud shows the most frequently used words in the chat. The larger the word, the more frequently it appears.")
             
-            wordcloud = utils.create_wordcloud(df, selected_user)
-            
-            fig, ax = plt.subplots()
-            ax.imshow(wordcloud, interpolation='bilinear')
-            ax.axis('off')
-            plt.tight_layout()
-            st.pyplot(fig)
+            # Computed only once opened (or prefetched with PREFETCH_SECTIONS=1)
+            if st.toggle('Show wordcloud', key='show_wordcloud'):
+                show_chart(scope, 'wordcloud', lambda: charts.wordcloud(result('wordcloud')))
             
             
             ################################################################################
             ############################### Most Busy Month & Day ######################################
             ################################################################################
-        with st.spinner("Finding Most Busy Month & Day..."):
+        with st.spinner("Finding Most Busy Month & Day..."), profiler.span("Busy month & day"):
 
             st.markdown("### 📅 Most Busy Month & Day")
             st.markdown("This shows the months & day with the most messages sent.")
 
-            busy_month_df = utils.most_busy_month(df, selected_user)
+            busy_month_df = result('busy_month')
 
             # Layout for chart and user table
             col1, col2 = st.columns(2)
@@ -188,7 +332,7 @@ if uploaded_file is not None:
                 st.bar_chart(busy_month_df[:10], x='busy_month', y='message', use_container_width=True, x_label="Month", y_label="Number of Messages")
                 
             
-            busy_day_df = utils.most_busy_day(df, selected_user)
+            busy_day_df = result('busy_day')
             
             with col2:
                 st.markdown("### 👥 Most Active Days")
@@ -199,190 +343,161 @@ if uploaded_file is not None:
             ################################################################################
             ############################### Most Busy Week & Hour ################################
             ################################################################################
-        with st.spinner("Finding Most Busy Week & Hour..."):
+        with st.spinner("Finding Most Busy Week & Hour..."), profiler.span("Busy week & hour"):
                 
                 st.markdown("### ⏰ Most Busy Week & Hour")
                 st.markdown("This shows the Weeks & hours with the most messages sent.")
     
-                busy_week_df = utils.most_busy_week(df, selected_user)
-                
-                # Prepare plot
-                fig, ax = plt.subplots(figsize=(10, 5))
-                colors = sns.color_palette("Spectral", len(busy_week_df))
-    
-                busy_weeks = list(reversed(busy_week_df['week']))
-                message_counts = list(reversed(busy_week_df['count']))
-    
-                bars = ax.bar(busy_weeks, message_counts, color=colors)
-    
-                for bar in bars:
-                    height = bar.get_height()
-                    ax.text(bar.get_x() + bar.get_width() / 2, height + 2, f'{height}', 
-                            ha='center', va='bottom', fontsize=10)
-    
-                ax.set_xlabel("Week", fontsize=12, labelpad=10)
-                ax.set_ylabel("Number of Messages", fontsize=12, labelpad=10)
-                ax.set_title("🕒 Messages per Week", fontsize=14, weight='bold', color='#fff')
-    
-                sns.despine()
-                plt.xticks(rotation=45)
-                plt.tight_layout()
-    
                 # Layout for chart and user table
                 col1, col2 = st.columns(2)
     
                 with col1:
                     st.markdown("### Top Weeks")
-                    st.pyplot(fig)
-                
-                
-                busy_hour_df = utils.most_busy_hour(df, selected_user)
-                
-                # Prepare plot
-                fig, ax = plt.subplots(figsize=(10, 5))
-                colors = sns.color_palette("Spectral", len(busy_hour_df))
-                
-                busy_hours = list(reversed(busy_hour_df['busy_hour']))
-                message_counts = list(reversed(busy_hour_df['message']))
-                
-                bars = ax.bar(busy_hours, message_counts, color=colors)
-                
-                for bar in bars:
-                    height = bar.get_height()
-                    ax.text(bar.get_x() + bar.get_width() / 2, height + 2, f'{height}', 
-                            ha='center', va='bottom', fontsize=10)
-                    
-                ax.set_xlabel("Hour", fontsize=12, labelpad=10)
-                ax.set_ylabel("Number of Messages", fontsize=12, labelpad=10)
-                
-                ax.set_title("🕒 Messages per Hour", fontsize=14, weight='bold', color='#fff')
-                
-                sns.despine()
-                plt.xticks(rotation=45)
-                plt.tight_layout()
+                    show_chart(scope, 'busy_weeks', lambda: charts.busy_weeks(result('busy_week')))
                 
                 with col2:
                     st.markdown("### Top Hours")
-                    st.pyplot(fig)
+                    show_chart(scope, 'busy_hours', lambda: charts.busy_hours(result('busy_hour')))
                     
         st.markdown("---")
                     
             ################################################################################
             ############################### User Activity ################################
             ################################################################################
-        with st.spinner("Finding User Activity..."):
-                
-            heatmap_data = utils.heatmap_activity(df, selected_user)
+        with st.spinner("Finding User Activity..."), profiler.span("Activity heatmap"):
             
             st.markdown("### 📊 User Activity Heatmap")
             st.markdown("This heatmap shows the activity of the user over the hours.")
             
-            fig, ax = plt.subplots(figsize=(12, 6))
-            sns.heatmap(
-                heatmap_data, 
-                linewidths=0.5, 
-                linecolor='gray',
-                annot=True,          
-                fmt='.0f',           
-                annot_kws={"size": 8}, 
-                ax=ax
-            )
-            ax.set_xlabel("Hour", fontsize=10)
-            ax.set_ylabel("Day", fontsize=10)
-            ax.set_title("User Activity Heatmap", fontsize=14, weight='bold', color='#fff')
+            show_chart(scope, 'heatmap', lambda: charts.activity_heatmap(result('heatmap')))
             
-            ax.set_xticks([i + 0.5 for i in range(len(heatmap_data.columns))])  
-            ax.set_xticklabels([column[1] for column in heatmap_data.columns], rotation=0, fontsize=9)
+        st.markdown("---")
+            ################################################################################
+            ############################### Conversation Dynamics ##########################
+            ################################################################################
+        with st.spinner("Finding Conversation Dynamics..."), profiler.span("Conversation dynamics"):
+
+            st.markdown("### 💬 Conversation Dynamics")
+            st.markdown("A conversation ends after a silence longer than the chosen gap; replies are messages answering someone else within a conversation.")
+
+            gap = st.number_input("Silence that ends a conversation (minutes)", min_value=1, max_value=24 * 60, value=dynamics.SESSION_GAP // 60, key="session_gap") * 60
+
+            # NumPy passes over the time-sorted chat, cheap enough for the script thread
+            sessions, median_minutes, median_messages, participants = dynamics.session_stats(chat, selected_user, gap)
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Conversations", utils.format_number_short(sessions))
+            col2.metric("Median Length", f"{median_minutes} min")
+            col3.metric("Median Messages", median_messages)
+            col4.metric("Avg. Participants", participants)
+
+            col1, col2 = st.columns(2)
+            with col1:
+                st.markdown("#### Who Starts and Ends Conversations")
+                st.dataframe(dynamics.conversation_starters(chat, gap), use_container_width=True, hide_index=True)
+            with col2:
+                st.markdown("#### Reply Time" if selected_user == 'All' else f"#### Reply Time of {selected_user} To")
+                st.dataframe(dynamics.reply_latency(chat, selected_user, gap), use_container_width=True, hide_index=True)
 
-            ax.set_yticks([i + 0.5 for i in range(len(heatmap_data.index))])    
-            ax.set_yticklabels([index[:3] for index in heatmap_data.index], rotation=0, fontsize=9)
-            
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            
-            st.pyplot(fig)
-            
         st.markdown("---")
             ################################################################################
             ############################### Most Used Words and Emojies Table ##############
             ################################################################################        
                 
-        with st.spinner("Finding Most Used Words and Emojies..."):
+        with st.spinner("Finding Most Used Words and Emojies..."), profiler.span("Words & emojis"):
             
             st.markdown("### 🗣️ Most Used Words and Emojies")
             st.markdown("This shows the most used words and emojies in the chat by user.")
             
-            words_and_emojies_df = utils.most_used_words_and_emojies(df, selected_user)                
+            words_and_emojies_df = result('words_and_emojis')                
             st.dataframe(words_and_emojies_df, use_container_width=True)
 
+            # Computed only once opened; approximate counts are marked with ≈
+            if st.toggle('Show distinct words and links', key='show_distinct'):
+                distinct_words, distinct_links = utils.distinct_counts(chat, selected_user, approximate)
+                prefix = '≈ ' if approximate else ''
+                col1, col2 = st.columns(2)
+                col1.metric("Distinct Words", f"{prefix}{distinct_words:,}")
+                col2.metric("Distinct Links", f"{prefix}{distinct_links:,}")
+
         st.markdown("---")
             ################################################################################
             ###################### Sentiment Analysis with table and barchart ##############
             ################################################################################
         
-        with st.spinner("Finding Sentiment Analysis..."):
+        with st.spinner("Finding Sentiment Analysis..."), profiler.span("Sentiment"):
             
             st.markdown("### 📊 Sentiment Analysis")
             st.markdown("This shows the sentiment analysis of the chat.")
 
-            sentiment_df, overal_df = utils.sentiment_analysis(df, selected_user)
+            # Computed only once opened (or prefetched with PREFETCH_SECTIONS=1)
+            if st.toggle('Show sentiment', key='show_sentiment'):
+                sentiment_df, overal_df = result('sentiment')
             
-            # Layout for chart and user table
-            col1, col2 = st.columns([2,3])
+                # Layout for chart and user table
+                col1, col2 = st.columns([2,3])
 
-            with col1:
-                st.markdown("#### Sentiment Analysis")
-                st.bar_chart(overal_df, x='Overall Mood', y='count', use_container_width=True, x_label="Sentiment", y_label="Number of Messages")
+                with col1:
+                    st.markdown("#### Sentiment Analysis")
+                    st.bar_chart(overal_df, x='Overall Mood', y='count', use_container_width=True, x_label="Sentiment", y_label="Number of Messages")
                 
-            with col2:
-                st.markdown("#### Sentiment Analysis Table By User")
-                st.dataframe(sentiment_df, use_container_width=True, hide_index=True)
+                with col2:
+                    st.markdown("#### Sentiment Analysis Table By User")
+                    st.dataframe(sentiment_df, use_container_width=True, hide_index=True)
             
             
             ################################################################################
             ################## Wordcloud For Most Mentioned users ###########################
             ################################################################################
-        with st.spinner("Fetching For Most Mentioned users..."):
+        with st.spinner("Fetching For Most Mentioned users..."), profiler.span("Mentions"):
 
             st.markdown("### 🗣️ Most Mentioned Users")
             st.markdown("This wordcloud shows the most frequently used words in the chat. The larger the word, the more frequently it appears.")
             
-            most_mentioned_users = utils.get_most_mentioned_users(df, selected_user)
+            # Computed only once opened (or prefetched with PREFETCH_SECTIONS=1)
+            if st.toggle('Show mentions', key='show_mentions'):
+                most_mentioned_users = result('mentions')
             
-            icons = ['👑', '🥈', '🥉']
+                icons = ['👑', '🥈', '🥉']
 
-            max_count = most_mentioned_users[0][1] if most_mentioned_users else 1
-            min_font = 10
-            max_font = 60
+                max_count = most_mentioned_users[0][1] if most_mentioned_users else 1
+                min_font = 10
+                max_font = 60
 
-            st.markdown("<div style='text-align:center; margin-bottom: 1rem;'>"
-                        "The bigger the name, the more they were mentioned in the chat!"
-                        "</div>", unsafe_allow_html=True)
+                st.markdown("<div style='text-align:center; margin-bottom: 1rem;'>"
+                            "The bigger the name, the more they were mentioned in the chat!"
+                            "</div>", unsafe_allow_html=True)
 
-            # Display each user
-            for i, (name, count) in enumerate(most_mentioned_users):
-                icon = icons[i] if i < len(icons) else ''
+                # Display each user
+                for i, (name, count) in enumerate(most_mentioned_users):
+                    icon = icons[i] if i < len(icons) else ''
                 
-                # Linear scaling of font size
-                font_size = min_font + ((count / max_count) * (max_font - min_font))
-
-                # Render name, icon, and count
-                st.markdown(
-                    f"""
-                    <div style='
-                        background-color: #262730;
-                        border-radius: 12px;
-                        padding: 5px;
-                        margin-bottom: 12px;
-                        box-shadow: 0 4px 12px rgba(0, 0, 0, 0.1);
-                        text-align: center;
-                        font-size: {font_size}px;
-                        font-weight: 500;
-                        transition: transform 0.2s ease-in-out;
-                    '>
-                        {icon} {name}<br>
-                        <span style='font-size: 0.6em; color: #555;'>{count} mentions</span>
-                    </div>
-                    """,
-                    unsafe_allow_html=True
-                )
\ No newline at end of file
+                    # Linear scaling of font size
+                    font_size = min_font + ((count / max_count) * (max_font - min_font))
+
+                    # Render name, icon, and count
+                    st.markdown(
+                        f"""
+                        <div style='
+                            background-color: #262730;
+                            border-radius: 12px;
+                            padding: 5px;
+                            margin-bottom: 12px;
+                            box-shadow: 0 4px 12px rgba(0, 0, 0, 0.1);
+                            text-align: center;
+                            font-size: {font_size}px;
+                            font-weight: 500;
+                            transition: transform 0.2s ease-in-out;
+                        '>
+                            {icon} {name}<br>
+                            <span style='font-size: 0.6em; color: #555;'>{count} mentions</span>
+                        </div>
+                        """,
+                        unsafe_allow_html=True
+                    )
+
+if run_profile is not None:
+    st.sidebar.caption(f"Profile written to {run_profile.stop()}")
+
+if st.sidebar.checkbox("Show profiling panel", value=os.environ.get('PROFILE_PANEL') == '1'):
+    st.sidebar.markdown(f"#### Profiling ({profiler.total_seconds():.2f} s)")
+    st.sidebar.dataframe(profiler.table(), hide_index=True, use_container_width=True)
@@ -1,46 +1,500 @@
+import os
 import re
+import codecs
+import itertools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
+from pandas.api.types import union_categoricals
 
 
+# Export layouts: Android "12/31/23, 10:15 PM - " and iOS "[31/12/23, 22:15:04] ".
+# A leading left-to-right mark is tolerated since iOS puts one before system lines.
+LAYOUTS = {
+    'android': {'prefix': r'\u200e?', 'suffix': r'\s-\s', 'template': '{} - ', 'seconds': False},
+    'ios': {'prefix': r'\u200e?\[', 'suffix': r'\]\s', 'template': '[{}] ', 'seconds': True},
+}
+DATE_ORDERS = {'mdy': '%m/%d', 'dmy': '%d/%m'}
+YEARS = {'yy': (r'\d{2}', '%y'), 'yyyy': (r'\d{4}', '%Y')}
+CLOCKS = {'12h': (r'\s[AaPp][Mm]', '%I', ' %p'), '24h': ('', '%H', '')}
 
-def preprocess_data(data):
-    data.replace('\u202f', ' ')
-    initial_pattern = r"\d{1,2}/\d{1,2}/\d{1,2},\s\d{1,2}:\d{1,2}\s[PA]M\s-\s"
-
-    messages = re.split(initial_pattern, data)[1:]
-    messages = [message.replace('\n', '') if message.endswith('\n') else message for message in messages]
-    
-    dates = re.findall(initial_pattern, data)
-    dates = [date.replace('\u202f', ' ')[:-3] for date in dates]
-
-    df = pd.DataFrame({'user_message': messages, 'message_date': dates})
-    
-    df['message_date'] = pd.to_datetime(df['message_date'], format='%m/%d/%y, %I:%M %p')
-
-    users = []
-    messages = []
-    for message in df['user_message']:
-        pattern = r'^([^\n:]+):\s([^\n:][\W\w]+)'
-        match = re.match(pattern, message)
-        if match:
-            users.append(match.group(1))
-            messages.append(match.group(2))
-        else:
-            users.append('Whatsapp')
-            messages.append(message)
-
-    df['user'] = users
-    df['message'] = messages
-
-    df['date'] = df['message_date'].dt.date
-    df['year'] = df['message_date'].dt.year
-    df['month'] = df['message_date'].dt.month_name()
-    df['week'] = df['message_date'].dt.isocalendar().week
-    df['day'] = df['message_date'].dt.day
-    df['day_name'] = df['message_date'].dt.day_name()
-    df['hour'] = df['message_date'].dt.strftime('%I')
-    df['minute'] = df['message_date'].dt.minute
-    df['meridiem'] = df['message_date'].dt.strftime('%p')   
-    df.drop(columns=['user_message', 'message_date', ], inplace=True)
-    return df
\ No newline at end of file
+DEFAULT_FORMAT = 'android_mdy_yy_12h'
+SNIFF_SIZE = 8192               # characters of the export inspected by detect_format
+COLUMNS = ['message_date', 'user', 'message']
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+MERIDIEMS = ['AM', 'PM']
+# Author of system notices (joins, group changes, ...)
+SYSTEM_USER = 'Whatsapp'
+
+# Format registry: name -> precompiled header / message patterns plus the
+# explicit pd.to_datetime format for that layout, so dates are never inferred
+# row by row.
+FORMATS = {}
+
+# Streaming parser settings
+STREAM_READ_SIZE = 1 << 20      # bytes (or characters) pulled from the source per read
+STREAM_BATCH_SIZE = 50_000      # messages per DataFrame batch
+
+# Parallel parser settings. Exports smaller than PARALLEL_MIN_SIZE characters,
+# or workers=1, always take the serial path. Each worker gets about
+# CHUNKS_PER_WORKER chunks, sliced only when handed over.
+PARSE_WORKERS = os.cpu_count() or 1
+PARALLEL_MIN_SIZE = 16 << 20
+CHUNKS_PER_WORKER = 4
+# Bytes decoded after a line start of a UTF-8 buffer to test it for a header
+HEADER_PEEK = 64
+
+
+def pool_context():
+    """
+    Start method for every process pool of the app. Never fork: pools are
+    started while other threads run (dashboard sections, RSS samplers), and
+    a forked child inherits any lock one of them holds, e.g. the import lock.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def register_format(name, layout, date_pattern, datetime_format, sibling=None):
+    prefix = LAYOUTS[layout]['prefix']
+    suffix = LAYOUTS[layout]['suffix']
+    header = prefix + date_pattern + suffix
+
+    # One pass over the export yields date, user and message together. A
+    # message runs until the next line that starts with a header; lines in
+    # between are continuation lines of a multi-line message.
+    message = re.compile(
+        r"^" + prefix + r"(?P<date>" + date_pattern + r")" + suffix +
+        r"(?:(?P<user>[^\n:]+):\s(?=[^\n:]))?"
+        r"(?P<message>[^\n]*(?:\n(?!" + header + r")[^\n]*)*)",
+        re.MULTILINE,
+    )
+    FORMATS[name] = {
+        'header': re.compile(header),
+        'line_start': re.compile(r"^" + header, re.MULTILINE),
+        'message': message,
+        'datetime_format': datetime_format,
+        'template': LAYOUTS[layout]['template'],
+        'sibling': sibling,
+    }
+
+
+for layout, options in LAYOUTS.items():
+    for order, order_format in DATE_ORDERS.items():
+        for year, (year_pattern, year_format) in YEARS.items():
+            for clock, (clock_pattern, hour_format, clock_format) in CLOCKS.items():
+                seconds_pattern, seconds_format = (r':\d{2}', ':%S') if options['seconds'] else ('', '')
+                other_order = 'dmy' if order == 'mdy' else 'mdy'
+                register_format(
+                    f'{layout}_{order}_{year}_{clock}',
+                    layout,
+                    r'\d{1,2}/\d{1,2}/' + year_pattern + r',\s\d{1,2}:\d{2}' + seconds_pattern + clock_pattern,
+                    f'{order_format}/{year_format}, {hour_format}:%M{seconds_format}{clock_format}',
+                    sibling=f'{layout}_{other_order}_{year}_{clock}',
+                )
+
+
+def detect_format(sample):
+    """
+    Pick the registered format that matches the most message headers in
+    `sample` (the first SNIFF_SIZE characters of an export) and whose dates all
+    parse. Month-first wins over day-first when the sample cannot tell them
+    apart; preprocess_data retries the other order if the full parse fails.
+    """
+    best, best_count = DEFAULT_FORMAT, 0
+    for name, fmt in FORMATS.items():
+        dates = [match.group('date') for match in fmt['message'].finditer(sample)]
+        if len(dates) <= best_count:
+            continue
+        parsed = pd.to_datetime(_normalize_dates(pd.Series(dates)), format=fmt['datetime_format'], errors='coerce')
+        if parsed.notna().all():
+            best, best_count = name, len(dates)
+    return best
+
+
+def _normalize_dates(dates):
+    return dates.str.replace(r'[\u202f\xa0]', ' ', regex=True)
+
+
+def _parse_rows(rows, chat_format):
+    df = pd.DataFrame(rows, columns=COLUMNS)
+
+    df['message_date'] = pd.to_datetime(_normalize_dates(df['message_date']), format=FORMATS[chat_format]['datetime_format'])
+    df['user'] = df['user'].mask(df['user'] == '', SYSTEM_USER)
+    df['message'] = df['message'].str.replace('\n', '', regex=False)
+    return df
+
+
+def _parse_chunk(text, chat_format):
+    return _parse_rows(FORMATS[chat_format]['message'].findall(text), chat_format)
+
+
+def _add_columns(df):
+    # Compact schema: categoricals for repeated labels, small integers for
+    # calendar fields and a datetime64 day instead of datetime.date objects.
+    # Everything is derived from integer datetime fields; strftime is avoided.
+    timestamps = df['message_date'].dt
+    hours = timestamps.hour.to_numpy()
+
+    df['user'] = df['user'].astype('category')
+    df['date'] = timestamps.normalize()
+    df['year'] = timestamps.year.astype('int16')
+    df['month'] = pd.Categorical.from_codes(timestamps.month.to_numpy() - 1, categories=MONTHS, ordered=True)
+    df['week'] = timestamps.isocalendar().week.astype('int8')
+    df['day'] = timestamps.day.astype('int8')
+    df['day_name'] = pd.Categorical.from_codes(timestamps.dayofweek.to_numpy(), categories=DAY_NAMES, ordered=True)
+    df['hour'] = ((hours + 11) % 12 + 1).astype('int8')
+    df['minute'] = timestamps.minute.astype('int8')
+    df['meridiem'] = pd.Categorical.from_codes((hours >= 12).astype('int8'), categories=MERIDIEMS)
+    # Seconds since 1970-01-01 (export wall-clock time), the sort key of the chat
+    df['epoch'] = df['message_date'].to_numpy().astype('datetime64[s]').view('int64')
+    df.drop(columns=['message_date', ], inplace=True)
+    return df
+
+
+def sort_by_time(df):
+    """
+    `df` ordered by `epoch`, so time ranges are binary searches. Exports are
+    written in send order, making this an O(n) check in the common case;
+    out-of-order rows (clock changes, merged exports) are moved with a stable
+    sort and the frame is flagged with attrs['reordered'].
+    """
+    epochs = df['epoch'].to_numpy()
+    if (epochs[1:] >= epochs[:-1]).all():
+        return df
+    df = df.take(np.argsort(epochs, kind='stable')).reset_index(drop=True)
+    df.attrs['reordered'] = True
+    return df
+
+
+def concat_frames(frames):
+    """
+    pd.concat for parsed chat frames. Categorical columns whose categories
+    differ between frames (e.g. `user`) are unified first, since pd.concat
+    would otherwise fall back to object dtype.
+    """
+    if len(frames) == 1:
+        return frames[0]
+    # Shallow copies, so the callers' frames keep their own categories
+    frames = [frame.copy(deep=False) for frame in frames]
+    for column in frames[0].select_dtypes('category'):
+        categories = union_categoricals([frame[column] for frame in frames]).categories
+        for frame in frames:
+            frame[column] = frame[column].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _build_frame(rows, chat_format=DEFAULT_FORMAT):
+    return _add_columns(_parse_rows(rows, chat_format))
+
+
+def _header_after(data, pos, chat_format):
+    # Offset of the first line after `pos` that begins with a message header, or None
+    match = FORMATS[chat_format]['line_start'].search(data, pos)
+    return match.start() if match else None
+
+
+def _byte_header_after(view, pos, chat_format):
+    # Same for a UTF-8 buffer: lines are found in the bytes and only the
+    # first HEADER_PEEK bytes of each are decoded
+    header = FORMATS[chat_format]['header']
+    while pos < len(view):
+        window = bytes(view[pos:pos + STREAM_READ_SIZE])
+        newline = window.find(b'\n')
+        while newline >= 0:
+            start = pos + newline + 1
+            if header.match(str(view[start:start + HEADER_PEEK], 'utf-8', 'ignore')):
+                return start
+            newline = window.find(b'\n', newline + 1)
+        pos += len(window)
+    return None
+
+
+def chunk_bounds(data, n_chunks, chat_format=DEFAULT_FORMAT):
+    """
+    (start, stop) offsets cutting `data` into about `n_chunks` pieces, each
+    starting on a line that begins with a message header, so no message is
+    split across chunks. `data` is a str, or a UTF-8 bytes-like object
+    whose offsets are then in bytes.
+    """
+    if isinstance(data, str):
+        find = _header_after
+    else:
+        data = memoryview(data)
+        find = _byte_header_after
+    bounds = [0]
+    for i in range(1, n_chunks):
+        start = find(data, max(len(data) * i // n_chunks, bounds[-1] + 1), chat_format)
+        if start is None:
+            break
+        bounds.append(start)
+    bounds.append(len(data))
+    return list(zip(bounds, bounds[1:]))
+
+
+def _parse_encoded(chunk, chat_format):
+    # Pool task for a byte range: the worker decodes its own chunk
+    return _parse_chunk(chunk.decode('utf-8'), chat_format)
+
+
+def _parse_parallel(data, chat_format, workers):
+    # Chunks are sliced when submitted, with at most `workers` waiting, so
+    # the export is never copied whole for the pool. Byte ranges of a UTF-8
+    # buffer are sent as bytes and decoded by the workers.
+    encoded = not isinstance(data, str)
+    if encoded:
+        data = memoryview(data)
+    frames = []
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as executor:
+        for start, stop in chunk_bounds(data, workers * CHUNKS_PER_WORKER, chat_format):
+            if len(pending) >= workers:
+                frames.append(pending.popleft().result())
+            if encoded:
+                pending.append(executor.submit(_parse_encoded, bytes(data[start:stop]), chat_format))
+            else:
+                pending.append(executor.submit(_parse_chunk, data[start:stop], chat_format))
+        frames.extend(future.result() for future in pending)
+    return pd.concat(frames, ignore_index=True)
+
+
+def preprocess_data(data, chat_format=None, workers=None):
+    """
+    Parse a whole export held in memory. Exports of at least PARALLEL_MIN_SIZE
+    characters are split at message boundaries and tokenized on `workers`
+    processes (PARSE_WORKERS by default); workers=1 forces the serial path.
+    Both paths return the same rows in the same order, sorted by time.
+    """
+    if chat_format is None:
+        chat_format = detect_format(data[:SNIFF_SIZE])
+    if workers is None:
+        workers = PARSE_WORKERS
+
+    def parse(chat_format):
+        if workers > 1 and len(data) >= PARALLEL_MIN_SIZE:
+            return _parse_parallel(data, chat_format, workers)
+        return _parse_chunk(data, chat_format)
+
+    try:
+        df = parse(chat_format)
+    except ValueError:
+        # The sniffed sample could not tell day-first from month-first
+        chat_format = FORMATS[chat_format]['sibling']
+        df = parse(chat_format)
+    df = sort_by_time(_add_columns(df))
+    df.attrs['chat_format'] = chat_format
+    return df
+
+
+def _iter_chunks(source):
+    # File objects are read in fixed-size pieces, anything else is treated as
+    # an iterable of bytes / str chunks.
+    if hasattr(source, 'read'):
+        while True:
+            chunk = source.read(STREAM_READ_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        yield from source
+
+
+def _iter_lines(source, encoding='utf-8'):
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    for chunk in _iter_chunks(source):
+        if isinstance(chunk, (bytes, bytearray, memoryview)):
+            chunk = decoder.decode(chunk)
+        pending += chunk
+        lines = pending.split('\n')
+        pending = lines.pop()
+        yield from lines
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def _sniff_lines(lines):
+    # Buffer the first SNIFF_SIZE characters to detect the format, then replay them
+    head = []
+    size = 0
+    for line in lines:
+        head.append(line)
+        size += len(line) + 1
+        if size >= SNIFF_SIZE:
+            break
+    return detect_format('\n'.join(head)), itertools.chain(head, lines)
+
+
+def _iter_rows(lines, chat_format):
+    header = FORMATS[chat_format]['header']
+    message = FORMATS[chat_format]['message']
+    buffer = []
+    for line in lines:
+        if header.match(line):
+            if buffer:
+                yield message.match('\n'.join(buffer)).groups('')
+            buffer = [line]
+        elif buffer:
+            buffer.append(line)
+    if buffer:
+        yield message.match('\n'.join(buffer)).groups('')
+
+
+def iter_messages(source, encoding='utf-8', chat_format=None):
+    """
+    Yield (date, user, message) tuples from a file object or an iterable of
+    byte / str chunks without holding the whole export in memory.
+    Lines are grouped per message and tokenized with the same pattern
+    preprocess_data uses, so multi-line messages come out identical.
+    """
+    lines = _iter_lines(source, encoding)
+    if chat_format is None:
+        chat_format, lines = _sniff_lines(lines)
+    return _iter_rows(lines, chat_format)
+
+
+def _iter_text(source, encoding='utf-8'):
+    # Decoded pieces of the source, in order
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in _iter_chunks(source):
+        if not isinstance(chunk, str):
+            chunk = decoder.decode(chunk)
+        yield chunk
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def _sniff_text(texts):
+    # Like _sniff_lines, for decoded pieces
+    head = []
+    size = 0
+    for text in texts:
+        head.append(text)
+        size += len(text)
+        if size >= SNIFF_SIZE:
+            break
+    return detect_format(''.join(head)[:SNIFF_SIZE]), itertools.chain(head, texts)
+
+
+def _last_message_start(text, header, start=0):
+    # Offset of the last line at or after `start` that begins with a header, or 0
+    end = len(text)
+    while True:
+        newline = text.rfind('\n', start, end)
+        if newline < 0:
+            return 0
+        if header.match(text, newline + 1):
+            return newline + 1
+        end = newline
+
+
+def _iter_blocks(texts, chat_format):
+    # Regroup decoded pieces into blocks that end right before a message
+    # header, so each block holds whole messages only
+    header = FORMATS[chat_format]['header']
+    pending = ''
+    # Newline before the last, possibly unfinished, line of `pending`: a
+    # header split across pieces starts there, so the next search does too
+    line_start = 0
+    for text in texts:
+        pending += text
+        cut = _last_message_start(pending, header, line_start)
+        if cut:
+            yield pending[:cut]
+            pending = pending[cut:]
+        searched = 0 if cut else line_start
+        newline = pending.rfind('\n', searched)
+        line_start = newline if newline >= 0 else searched
+    if pending:
+        yield pending
+
+
+def _stream_frames(texts, chat_format, batch_size):
+    # Blocks are tokenized with the same findall as preprocess_data, which
+    # keeps the streaming parser as fast as the in-memory one
+    message = FORMATS[chat_format]['message']
+    frames = []
+    rows = []
+    for block in _iter_blocks(texts, chat_format):
+        rows.extend(message.findall(block))
+        if len(rows) >= batch_size:
+            frames.append(_build_frame(rows, chat_format))
+            rows = []
+
+    if rows or not frames:
+        frames.append(_build_frame(rows, chat_format))
+
+    df = sort_by_time(concat_frames(frames))
+    df.attrs['chat_format'] = chat_format
+    return df
+
+
+def preprocess_stream(source, batch_size=STREAM_BATCH_SIZE, encoding='utf-8', chat_format=None):
+    """
+    Streaming counterpart of preprocess_data.
+    Text is read lazily from `source` (a binary / text file object or an
+    iterable of chunks), cut at message boundaries and turned into DataFrame
+    batches of about `batch_size` rows, so peak memory is bounded by the
+    batch rather than the export size.
+    The format is sniffed from the first SNIFF_SIZE characters; pass
+    `chat_format` explicitly for day-first exports whose opening days are
+    all <= 12.
+    """
+    texts = _iter_text(source, encoding)
+    if chat_format is None:
+        chat_format, texts = _sniff_text(texts)
+    return _stream_frames(texts, chat_format, batch_size)
+
+
+def preprocess_source(open_source, batch_size=STREAM_BATCH_SIZE, encoding='utf-8', chat_format=None):
+    """
+    preprocess_stream for a source that can be read more than once:
+    `open_source()` returns a fresh file object or chunk iterable on every
+    call. Like preprocess_data, the other day/month order is tried when the
+    dates do not parse in the detected one.
+    """
+    texts = _iter_text(open_source(), encoding)
+    if chat_format is None:
+        chat_format, texts = _sniff_text(texts)
+    try:
+        return _stream_frames(texts, chat_format, batch_size)
+    except ValueError:
+        return _stream_frames(_iter_text(open_source(), encoding), FORMATS[chat_format]['sibling'], batch_size)
+
+
+def preprocess_buffer(buffer, chat_format=None, workers=None):
+    """
+    Parse an export held as UTF-8 bytes (bytes, mmap, memoryview) without
+    decoding it whole. Buffers of at least PARALLEL_MIN_SIZE bytes are cut
+    at header offsets and each of `workers` processes decodes and tokenizes
+    only its own byte ranges; smaller ones, or workers=1, are streamed
+    through preprocess_source.
+    """
+    if workers is None:
+        workers = PARSE_WORKERS
+    if workers <= 1 or len(buffer) < PARALLEL_MIN_SIZE:
+        return preprocess_source(lambda: iter_buffer(buffer), chat_format=chat_format)
+
+    view = memoryview(buffer)
+    if chat_format is None:
+        chat_format = detect_format(str(view[:4 * SNIFF_SIZE], 'utf-8', 'ignore')[:SNIFF_SIZE])
+    try:
+        df = _parse_parallel(view, chat_format, workers)
+    except ValueError:
+        chat_format = FORMATS[chat_format]['sibling']
+        df = _parse_parallel(view, chat_format, workers)
+    df = sort_by_time(_add_columns(df))
+    df.attrs['chat_format'] = chat_format
+    return df
+
+
+def iter_buffer(buffer, size=STREAM_READ_SIZE):
+    # Zero-copy chunks of a bytes-like object (bytes, mmap, memoryview)
+    view = memoryview(buffer)
+    for start in range(0, len(view), size):
+        yield view[start:start + size]
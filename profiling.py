@@ -0,0 +1,263 @@
+"""
+Timing / memory spans for the dashboard.
+
+A Profiler records nested spans (wall time, peak RSS growth sampled during
+the span, cache status). instrument(module) wraps a module's public functions so every
+call made while a profiler is active on the current thread becomes a span;
+Streamlit runs each session's script on its own thread, so sessions do not
+see each other's spans. Work handed to a pool thread records its spans with
+profiled_by() and joins the run's table through Profiler.merge(). RunProfile dumps a cProfile (or pyinstrument) profile
+of a whole rerun for offline analysis.
+"""
+import os
+import sys
+import time
+import cProfile
+import functools
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; RSS columns stay empty there
+    resource = None
+
+
+PROFILE_ENGINES = {'cprofile': 'prof', 'pyinstrument': 'html'}
+
+_local = threading.local()
+
+
+def current_rss():
+    # Resident set size right now in bytes (Linux /proc); None elsewhere
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss():
+    # Peak resident set size of this process in bytes (ru_maxrss is KiB on Linux, bytes on macOS)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class MemoryTracker:
+    """
+    Peak memory of a block: RSS is sampled every `interval` seconds on a
+    background thread and `peak_delta` is the highest RSS seen minus the RSS
+    at entry. Where current RSS is not readable, the growth of the process
+    peak RSS is used instead.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak_delta = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._peak = max(self._peak, current_rss())
+
+    def __enter__(self):
+        self._start = current_rss()
+        if self._start is None:
+            self._start = peak_rss()
+        else:
+            self._peak = self._start
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak_delta = max(self._peak, current_rss()) - self._start
+        elif self._start is not None:
+            self.peak_delta = peak_rss() - self._start
+
+
+class Span:
+    def __init__(self, name, kind, depth, cache=None):
+        self.name = name
+        self.kind = kind
+        self.depth = depth
+        self.cache = cache
+        self.seconds = None
+        self.rss_delta = None
+        # Recorded on a pool thread, concurrently with the script
+        self.pooled = False
+
+
+class Profiler:
+    """
+    Spans of one script run, in the order they were opened.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._depth = 0
+        self._in_call = False
+
+    @contextmanager
+    def span(self, name, kind='section', cache=None):
+        # Set span.cache inside the block to report e.g. 'hit' / 'miss'
+        span = Span(name, kind, self._depth, cache)
+        self.spans.append(span)
+        self._depth += 1
+        # Current RSS is sampled during the span: the process peak RSS
+        # rarely moves on a warm server, so its growth would read 0
+        memory = MemoryTracker()
+        start = time.perf_counter()
+        try:
+            with memory:
+                yield span
+        finally:
+            span.seconds = time.perf_counter() - start
+            span.rss_delta = memory.peak_delta
+            self._depth -= 1
+
+    def merge(self, other):
+        # Spans `other` recorded on a pool thread, nested under the span open here
+        for span in other.spans:
+            span.depth += self._depth
+            span.pooled = True
+            self.spans.append(span)
+        other.spans = []
+
+    def table(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            'span': [' ' * span.depth + span.name for span in self.spans],
+            'kind': [f"{span.kind} (pool)" if span.pooled else span.kind for span in self.spans],
+            'ms': [round(span.seconds * 1000, 1) if span.seconds is not None else None for span in self.spans],
+            'peak RSS +MiB': [round(span.rss_delta / 2**20, 1) if span.rss_delta is not None else None for span in self.spans],
+            'cache': [span.cache or '' for span in self.spans],
+        })
+
+    def total_seconds(self):
+        # Pooled spans overlap the script's own spans, so they do not add up
+        return sum(span.seconds or 0 for span in self.spans if span.depth == 0 and not span.pooled)
+
+
+def activate(profiler):
+    # Spans of instrumented calls on this thread go to `profiler` (None turns them off)
+    _local.profiler = profiler
+
+
+def current():
+    return getattr(_local, 'profiler', None)
+
+
+def profiled_by(profiler, func):
+    """
+    `func` wrapped so the instrumented calls it makes are recorded on
+    `profiler`, whichever thread runs it (e.g. a pool thread, where no
+    profiler is active).
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = current()
+        activate(profiler)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            activate(previous)
+    return wrapper
+
+
+def _traced(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = current()
+        # Calls made by an instrumented function are part of its span
+        if profiler is None or profiler._in_call:
+            return func(*args, **kwargs)
+
+        # Chat arguments count their derived computations; none means a cache hit
+        computed = getattr(args[0], 'computed', None) if args else None
+        profiler._in_call = True
+        try:
+            with profiler.span(name, 'call') as span:
+                result = func(*args, **kwargs)
+                if computed is not None:
+                    span.cache = 'hit' if args[0].computed == computed else 'miss'
+        finally:
+            profiler._in_call = False
+        return result
+
+    wrapper.__traced__ = True
+    return wrapper
+
+
+def instrument(module, names=None):
+    """
+    Replace the public functions of `module` (or just `names`) with wrappers
+    that record a span per outermost call. Safe to call again; wrapped functions are
+    left alone.
+    """
+    if names is None:
+        names = [name for name, value in vars(module).items()
+                 if not name.startswith('_') and callable(value) and getattr(value, '__module__', None) == module.__name__
+                 and not isinstance(value, type)]
+    for name in names:
+        func = getattr(module, name)
+        if not getattr(func, '__traced__', False):
+            setattr(module, name, _traced(f"{module.__name__}.{name}", func))
+
+
+class RunProfile:
+    """
+    Deterministic profile of everything between start() and stop(), written
+    to `path`: pstats data for 'cprofile' (open with snakeviz / pstats) or an
+    HTML report for 'pyinstrument', which must be installed separately.
+    """
+
+    def __init__(self, path, engine='cprofile'):
+        if engine not in PROFILE_ENGINES:
+            raise ValueError(f"Unknown profile engine {engine!r}, expected one of {sorted(PROFILE_ENGINES)}")
+        self.path = path
+        self.engine = engine
+        self._profiler = None
+
+    @classmethod
+    def in_directory(cls, directory, engine='cprofile'):
+        os.makedirs(directory, exist_ok=True)
+        name = f"rerun-{time.strftime('%Y%m%d-%H%M%S')}-{threading.get_ident()}.{PROFILE_ENGINES.get(engine, 'prof')}"
+        return cls(os.path.join(directory, name), engine)
+
+    def start(self):
+        if self.engine == 'pyinstrument':
+            try:
+                import pyinstrument
+            except ImportError as error:
+                raise RuntimeError("pyinstrument is not installed. Install it with:\n\n    pip install pyinstrument") from error
+            self._profiler = pyinstrument.Profiler()
+            self._profiler.start()
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def stop(self):
+        if self.engine == 'pyinstrument':
+            self._profiler.stop()
+            with open(self.path, 'w') as file:
+                file.write(self._profiler.output_html())
+        else:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.path)
+        return self.path
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,168 @@
+"""
+Fixed-memory summaries behind the approximate analytics mode.
+
+Each structure is fed batches of tokens (or messages) and keeps a bounded
+state whatever the size of the chat. With N the number of tokens added:
+
+- CountMinSketch(epsilon, delta): estimates never undercount, and overcount
+  by more than epsilon * N with probability at most delta. Memory is
+  ceil(e / epsilon) * ceil(ln(1 / delta)) counters.
+- SpaceSaving(k): the heavy hitters. Every token counted more than
+  N / (k + 1) times is kept, and its count is known to within N / (k + 1).
+  Memory is k tokens.
+- HyperLogLog(precision): distinct count with a relative standard error of
+  1.04 / sqrt(2 ** precision), i.e. 1.6 % with 4 KiB at the default precision.
+- Reservoir(size): a uniform random sample of `size` items.
+
+tests/test_sketches.py checks these bounds against the exact counts.
+"""
+import math
+import heapq
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+
+
+def hash_tokens(tokens) -> np.ndarray:
+    # 64-bit hashes that are stable across processes (SipHash with pandas'
+    # fixed key), unlike hash() under PYTHONHASHSEED
+    return pd.util.hash_array(np.asarray(tokens, dtype=object))
+
+
+class CountMinSketch:
+    """
+    Token frequencies in a fixed (depth, width) table of counters. A token
+    adds to one counter per row; its estimate is the smallest of them.
+    """
+
+    def __init__(self, epsilon=1e-4, delta=0.01):
+        self.epsilon = epsilon
+        self.delta = delta
+        self.width = math.ceil(math.e / epsilon)
+        self.depth = math.ceil(math.log(1 / delta))
+        self.table = np.zeros((self.depth, self.width), dtype=np.int64)
+        self.total = 0
+
+    def _columns(self, hashes: np.ndarray) -> np.ndarray:
+        # Row i hashes with h1 + i * h2 (Kirsch-Mitzenmacher), from one 64-bit hash
+        h1 = hashes & np.uint64(0xFFFFFFFF)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        rows = np.arange(self.depth, dtype=np.uint64)[:, None]
+        return ((h1 + rows * h2) % np.uint64(self.width)).astype(np.intp)
+
+    def add(self, hashes: np.ndarray, counts=None):
+        # `counts` (same length as `hashes`) defaults to one per hash
+        columns = self._columns(hashes)
+        for row in range(self.depth):
+            self.table[row] += np.bincount(columns[row], weights=counts, minlength=self.width).astype(np.int64)
+        self.total += len(hashes) if counts is None else int(np.sum(counts))
+
+    def estimate(self, hashes: np.ndarray) -> np.ndarray:
+        columns = self._columns(hashes)
+        return self.table[np.arange(self.depth)[:, None], columns].min(axis=0)
+
+    @property
+    def error_bound(self):
+        # Overcount not exceeded with probability 1 - delta
+        return self.epsilon * self.total
+
+
+class SpaceSaving:
+    """
+    The up to `k` most frequent tokens, updated with exact counts of one
+    batch at a time. This is the mergeable form of space-saving /
+    Misra-Gries (Agarwal et al., 2012). `counts` are lower bounds; a token
+    is underestimated by at most `error`, which stays <= N / (k + 1).
+    """
+
+    def __init__(self, k=500):
+        self.k = k
+        self.counts = {}
+        self.error = 0
+        self.total = 0
+
+    def update(self, batch):
+        # `batch` maps token -> exact count in the batch (e.g. a Counter)
+        counts = self.counts
+        for token, count in batch.items():
+            counts[token] = counts.get(token, 0) + count
+        self.total += sum(batch.values())
+        if len(counts) > self.k:
+            # Subtract the (k+1)-th largest count from every token and keep the positive ones
+            largest = heapq.nlargest(self.k + 1, counts.items(), key=itemgetter(1))
+            cut = largest[-1][1]
+            self.counts = {token: count - cut for token, count in largest[:-1] if count > cut}
+            self.error += cut
+
+    def most_common(self, n=None):
+        return sorted(self.counts.items(), key=itemgetter(1), reverse=True)[:n]
+
+
+class HyperLogLog:
+    """
+    Distinct count of hashed items in 2 ** precision one-byte registers.
+    """
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, hashes: np.ndarray):
+        if not len(hashes):
+            return
+        # The leading `precision` bits pick a register; the rank is the
+        # position of the first set bit in the remaining ones
+        bits = 64 - self.precision
+        index = (hashes >> np.uint64(bits)).astype(np.intp)
+        rest = hashes & np.uint64((1 << bits) - 1)
+        high = (rest >> np.uint64(32)).astype(np.float64)
+        low = (rest & np.uint64(0xFFFFFFFF)).astype(np.float64)
+        # Exact bit lengths from two 32-bit halves (float64 is exact there)
+        with np.errstate(divide='ignore'):
+            length = np.where(high > 0, 32 + np.floor(np.log2(high)) + 1, np.where(low > 0, np.floor(np.log2(low)) + 1, 0))
+        rank = (bits - length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    @property
+    def relative_error(self):
+        # Standard error of count() relative to the true count
+        return 1.04 / math.sqrt(len(self.registers))
+
+
+class Reservoir:
+    """
+    Uniform sample of up to `size` items of a stream fed in batches
+    (algorithm R, with the per-item draws vectorized).
+    """
+
+    def __init__(self, size, seed=0):
+        self.size = size
+        self.seen = 0
+        self.sample = np.empty(0, dtype=object)
+        self._rng = np.random.default_rng(seed)
+
+    def add(self, items):
+        items = np.asarray(items, dtype=object)
+        fill = min(max(self.size - len(self.sample), 0), len(items))
+        if fill:
+            self.sample = np.concatenate([self.sample, items[:fill]])
+        rest = items[fill:]
+        if len(rest):
+            # Item number t (0-based) replaces a random slot with probability size / (t + 1)
+            positions = self.seen + fill + np.arange(len(rest))
+            slots = self._rng.integers(0, positions + 1)
+            kept = slots < self.size
+            # Later items win on repeated slots, as in the sequential algorithm
+            self.sample[slots[kept]] = rest[kept]
+        self.seen += len(items)
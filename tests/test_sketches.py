@@ -0,0 +1,147 @@
+"""
+The error bounds documented in sketches.py, checked against exact counts:
+on a Zipf-distributed token stream, and end to end on the approximate mode
+of utils against its exact path.
+"""
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import preprocessing as pre
+import utils
+from chat import Chat
+from sketches import CountMinSketch, HyperLogLog, Reservoir, SpaceSaving, hash_tokens
+
+
+N_TOKENS = 500_000
+BATCH = 50_000
+
+
+def zipf_chat(n_messages, users=('Alice', 'Bob', 'Carol'), seed=0):
+    # Export whose words ("w1", "w2", ...), emojis and links follow Zipf
+    # laws, so the vocabulary is far larger than the sketches' capacity
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    template = pre.FORMATS[pre.DEFAULT_FORMAT]['template']
+    datetime_format = pre.FORMATS[pre.DEFAULT_FORMAT]['datetime_format']
+    emojis = sorted(utils.emoji.EMOJI_DATA)[:200]
+    timestamp = datetime(2023, 1, 13, 9, 0)
+    lines = []
+    for _ in range(n_messages):
+        timestamp += timedelta(minutes=rng.randint(0, 30))
+        words = ' '.join(f"w{rank}" for rank in np_rng.zipf(1.3, rng.randint(1, 10)))
+        emoji = emojis[min(int(np_rng.zipf(1.5)), len(emojis)) - 1]
+        link = f" https://example.com/p{np_rng.zipf(1.3)}" if rng.random() < 0.3 else ''
+        lines.append(f"{template.format(timestamp.strftime(datetime_format))}{rng.choice(users)}: {words} {emoji}{link}\n")
+    return ''.join(lines)
+
+
+@pytest.fixture(scope='module')
+def zipf_tokens():
+    rng = np.random.default_rng(0)
+    tokens = np.char.add('w', rng.zipf(1.2, N_TOKENS).astype(str)).astype(object)
+    return tokens, Counter(tokens)
+
+
+@pytest.fixture(scope='module')
+def chat():
+    return Chat(pre.preprocess_data(zipf_chat(20_000)))
+
+
+def batches(values, size=BATCH):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def test_count_min_bounds(zipf_tokens):
+    tokens, exact = zipf_tokens
+    sketch = CountMinSketch(epsilon=1e-3)
+    for batch in batches(tokens):
+        counts = Counter(batch)
+        sketch.add(hash_tokens(list(counts)), np.fromiter(counts.values(), dtype=np.float64, count=len(counts)))
+
+    assert sketch.total == N_TOKENS
+    overcount = sketch.estimate(hash_tokens(list(exact))) - np.fromiter(exact.values(), dtype=np.int64, count=len(exact))
+    assert overcount.min() >= 0
+    assert np.mean(overcount > sketch.error_bound) <= sketch.delta
+
+
+def test_space_saving_bounds(zipf_tokens):
+    tokens, exact = zipf_tokens
+    summary = SpaceSaving(k=100)
+    for batch in batches(tokens):
+        summary.update(Counter(batch))
+
+    limit = N_TOKENS / (summary.k + 1)
+    assert len(summary.counts) <= summary.k
+    assert summary.error <= limit
+    # Every heavy hitter is kept, undercounted by at most `error`
+    assert all(token in summary.counts for token, count in exact.items() if count > limit)
+    assert all(0 <= exact[token] - count <= summary.error for token, count in summary.counts.items())
+    assert [token for token, _ in summary.most_common(5)] == [token for token, _ in exact.most_common(5)]
+
+
+@pytest.mark.parametrize('n_distinct', [100, 5_000, 1_000_000])
+def test_hyperloglog_relative_error(n_distinct):
+    sketch = HyperLogLog()
+    values = np.arange(n_distinct).astype(str).astype(object)
+    for batch in batches(values, 100_000):
+        # Repeats do not count
+        sketch.add(hash_tokens(batch))
+        sketch.add(hash_tokens(batch[:10]))
+    assert abs(sketch.count() - n_distinct) <= 3 * sketch.relative_error * n_distinct
+
+
+def test_reservoir_is_uniform():
+    reservoir = Reservoir(1000, seed=0)
+    for batch in batches(np.arange(1_000_000), 7_919):
+        reservoir.add(batch)
+    sample = reservoir.sample.astype(np.int64)
+
+    assert reservoir.seen == 1_000_000
+    assert len(np.unique(sample)) == 1000
+    # The mean of a uniform sample of 0..n-1 is n/2 with a standard error of n * sqrt(1/12/size)
+    assert abs(sample.mean() / 1_000_000 - 0.5) <= 4 * (1 / 12 / 1000) ** 0.5
+
+
+def test_reservoir_keeps_short_streams():
+    reservoir = Reservoir(10)
+    reservoir.add(['a', 'b'])
+    reservoir.add(['c'])
+    assert list(reservoir.sample) == ['a', 'b', 'c']
+
+
+@pytest.mark.parametrize('kind', ['words', 'emojis'])
+def test_approximate_most_common_matches_exact(chat, kind):
+    bound = chat.derived('token_sketches', utils._token_sketches)[kind]['count_min'].error_bound
+    for user in ['All'] + chat.users:
+        exact = utils.token_counter(chat, kind, user)
+        approximate = utils.approximate_most_common(chat, kind, user, 5)
+
+        assert [token for token, _ in approximate] == [token for token, _ in exact.most_common(5)]
+        assert all(exact[token] <= estimate <= exact[token] + bound for token, estimate in approximate)
+
+
+def test_most_used_words_and_emojies_approximate(chat):
+    exact = utils.most_used_words_and_emojies(chat, 'All')
+    approximate = utils.most_used_words_and_emojies(chat, 'All', approximate=True)
+    assert approximate.equals(exact)
+
+
+def test_approximate_distinct_counts(chat):
+    exact_words, exact_links = utils.distinct_counts(chat, 'All')
+    words, links = utils.distinct_counts(chat, 'All', approximate=True)
+    error = 3 * HyperLogLog().relative_error
+    assert abs(words - exact_words) <= error * exact_words
+    assert exact_links > 0
+    assert abs(links - exact_links) <= error * exact_links
+
+
+def test_approximate_wordcloud_sample(chat):
+    messages = chat.df['message'].to_numpy()
+    sample = utils.sample_messages(messages, size=100)
+    assert len(sample) == 100
+    assert set(sample) <= set(messages)
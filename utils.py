@@ -1,29 +1,151 @@
-import pandas as pd
-import spacy.cli
-import spacy.cli.download
-from urlextract import URLExtract
-from wordcloud import WordCloud
-import matplotlib.pyplot as plt
-import seaborn as sns
-import spacy
+import os
+import re
+import functools
+import threading
 from collections import Counter
-from spacy.lang.en import stop_words
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
 import emoji
-import re
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
-import nltk
+
+import preprocessing as pre
+from chat import Chat
+from sketches import CountMinSketch, HyperLogLog, Reservoir, SpaceSaving, hash_tokens
+
+
+# NLP resources are loaded lazily, once per process, and only from local
+# installs: nothing is downloaded at runtime. SPACY_MODEL may be an installed
+# package name or a model directory; NLTK looks in NLTK_DATA as usual.
+SPACY_MODEL = os.environ.get('SPACY_MODEL', 'en_core_web_md')
+
+_resources = {}
+_resource_locks = {}
+_resource_locks_lock = threading.Lock()
+
+
+def _load_once(name, loader):
+    # One lock per resource, so a slow load (spaCy) never holds up the others
+    if name in _resources:
+        return _resources[name]
+    with _resource_locks_lock:
+        lock = _resource_locks.setdefault(name, threading.Lock())
+    with lock:
+        if name not in _resources:
+            _resources[name] = loader()
+        return _resources[name]
+
+
+def _load_nlp():
+    import spacy
+    try:
+        return spacy.load(SPACY_MODEL)
+    except OSError as error:
+        raise RuntimeError(
+            f"spaCy model '{SPACY_MODEL}' is not available locally. Install it when building the "
+            f"environment (python -m spacy download {SPACY_MODEL}) or set SPACY_MODEL to a model directory."
+        ) from error
+
+
+def _load_sentiment_analyzer():
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer
+    try:
+        return SentimentIntensityAnalyzer()
+    except LookupError as error:
+        raise RuntimeError(
+            "NLTK 'vader_lexicon' is not available locally. Install it when building the environment "
+            "(python -m nltk.downloader vader_lexicon) or point NLTK_DATA at a directory containing it."
+        ) from error
+
+
+def _load_url_extractor():
+    from urlextract import URLExtract
+    # Reads the TLD list bundled with the package on construction, so build it once
+    return URLExtract()
+
+
+def _load_stop_words():
+    from spacy.lang.en.stop_words import STOP_WORDS
+    return STOP_WORDS
+
+
+def get_nlp():
+    return _load_once('nlp', _load_nlp)
 
 
-nltk.download('vader_lexicon')
+def get_sentiment_analyzer():
+    return _load_once('sentiment_analyzer', _load_sentiment_analyzer)
 
-sia = SentimentIntensityAnalyzer()
-nlp = None
 
-try:
-    nlp = spacy.load("en_core_web_md")
-except OSError:
-    spacy.cli.download("en_core_web_md")
-    nlp = spacy.load("en_core_web_md")
+def get_url_extractor():
+    return _load_once('url_extractor', _load_url_extractor)
+
+
+def get_stop_words():
+    return _load_once('stop_words', _load_stop_words)
+
+
+def preload_models():
+    # Pay the model loading cost up front instead of on first use
+    get_nlp()
+    get_sentiment_analyzer()
+    get_url_extractor()
+    get_stop_words()
+
+
+# Messages per nlp.pipe batch when tokenizing for the wordcloud
+WORDCLOUD_BATCH_SIZE = 1000
+
+# Approximate mode (approximate=True): messages are tokenized APPROX_BATCH at
+# a time into fixed-size sketches (see sketches.py); word / emoji rankings
+# keep APPROX_TOP_K candidates per user and the wordcloud is drawn from a
+# uniform sample of WORDCLOUD_SAMPLE messages
+APPROX_BATCH = 10_000
+APPROX_TOP_K = 500
+WORDCLOUD_SAMPLE = 20_000
+
+# Sentiment scoring: unique texts below SENTIMENT_PARALLEL_MIN are scored in-process
+SENTIMENT_WORKERS = os.cpu_count() or 1
+SENTIMENT_PARALLEL_MIN = 50_000
+MOODS = ['🟡 Positive Vibes Only', '⚪ Calm & Collected', '🔵 Might Need a Hug']
+
+# Word tokens are what is left after stripping punctuation; emojis can only
+# sit in non-ASCII runs (keycaps start with one of '#*0-9')
+NON_WORD_PATTERN = re.compile(r'[^\w\s]')
+EMOJI_CANDIDATE_PATTERN = re.compile(r'[#*0-9]?[^\x00-\x7f]+')
+
+# Only messages with something like "example.com" or "://" can contain a URL
+URL_CANDIDATE_PATTERN = re.compile(r'\w\.\w|://')
+
+# Columns of summary_table, in the order stats() / get_averages() return them
+STAT_COLUMNS = [
+    'total_messages', 'total_words', 'total_media_messages', 'total_links',
+    'total_characters', 'average_words', 'longest_message_length', 'shortest_message_length',
+    'most_active_day', 'active_days', 'longest_streak', 'max_gap',
+]
+AVERAGE_COLUMNS = ['per_month', 'per_day', 'per_week', 'per_hour']
+SUMMARY_LABELS = dict(zip(STAT_COLUMNS + AVERAGE_COLUMNS, [
+    'Total Messages', 'Total Words', 'Media Shared', 'Links Shared',
+    'Total Characters', 'Avg. Words per Msg', 'Longest Msg Length', 'Shortest Msg Length',
+    'Most Active Day', 'Active Days', 'Longest Streak (days)', 'Longest Inactive Gap (days)',
+    'Avg. Messages per Month', 'Avg. Messages per Day', 'Avg. Messages per Week', 'Avg. Messages per Hour',
+]))
+
+# Periods of get_line_chat_of_message_history: calendar days, weeks starting on Monday, months
+HISTORY_FREQUENCIES = {'D': 'Daily', 'W': 'Weekly', 'M': 'Monthly'}
+
+
+def _select(df: pd.DataFrame | Chat, selected_user: str) -> pd.DataFrame:
+    # Chat objects answer from their user index, plain frames fall back to a mask
+    if isinstance(df, Chat):
+        return df.for_user(selected_user)
+    if selected_user != 'All':
+        df = df[df['user'] == selected_user]
+    return df
+
+
+def _as_chat(df: pd.DataFrame | Chat) -> Chat:
+    return df if isinstance(df, Chat) else Chat(df)
 
 
 def format_number_short(number):
@@ -45,265 +167,683 @@ def format_number_short(number):
         return str(number)
 
 
-def stats(df: pd.DataFrame, selected_user: str):
-    if selected_user != 'All':
-        df = df[df['user'] == selected_user]
+def _lengths(values, length=len) -> np.ndarray:
+    # map() over the object array runs at C speed; pandas .str methods are slower here
+    return np.fromiter(map(length, values), dtype=np.int64, count=len(values))
 
-    # Total Messages
-    all_messages = df['message'].to_list()
-    total_messages = len(all_messages)
-
-    # Total Words
-    total_words = sum(len(message.split()) for message in all_messages)
-
-    # Total Media Messages
-    total_media_messages = df[df['message'] == '<Media omitted>'].shape[0]
-
-    # Total Links
-    extractor = URLExtract()
-    total_links = sum(len(extractor.find_urls(message)) for message in all_messages)
-
-    # Total Characters
-    total_characters = sum(len(message) for message in all_messages)
-
-    # Average Words per Message
-    average_words = total_words // total_messages if total_messages > 0 else 0
-
-    # Longest Message Length
-    longest_message_length = len(max(all_messages, key=len)) if all_messages else 0
-
-    # Shortest Message Length
-    shortest_message_length = len(min(all_messages, key=len)) if all_messages else 0
-
-    # Most Active Day (and its count)
-    most_active_day = df['day_name'].value_counts().idxmax()
-    most_active_day_count = df['day_name'].value_counts().max()
-
-    # Number of Days Active
-    active_days = df['date'].nunique()
-
-    # Longest Streak of Consecutive Active Days
-    all_dates = pd.to_datetime(df['date'].unique())
-    all_dates = pd.Series(sorted(all_dates))
-    streaks = (all_dates.diff() != pd.Timedelta(days=1)).cumsum()
-    longest_streak = streaks.value_counts().max()
-
-    # Longest Inactive Gap (in days)
-    max_gap = all_dates.diff().max().days if len(all_dates) > 1 else 0
-
-    return (
-        format_number_short(total_messages),
-        format_number_short(total_words),
-        format_number_short(total_media_messages),
-        format_number_short(total_links),
-        format_number_short(total_characters),
-        format_number_short(average_words),
-        format_number_short(longest_message_length),
-        format_number_short(shortest_message_length),
-        most_active_day,
-        format_number_short(active_days),
-        format_number_short(longest_streak),
-        format_number_short(max_gap)
+
+def _url_counts(messages) -> np.ndarray:
+    # URLs per message; the extractor only runs on messages that can hold one
+    extractor = get_url_extractor()
+    return np.fromiter(
+        (len(extractor.find_urls(message)) if URL_CANDIDATE_PATTERN.search(message) else 0 for message in messages),
+        dtype=np.int64, count=len(messages),
     )
 
 
-def most_busy_user(df: pd.DataFrame, selected_user: str):
-    if selected_user != 'All':
-        df = df[df['user'] == selected_user]
-    return df['user'].value_counts().reset_index()
+def count_urls(messages) -> int:
+    return int(_url_counts(messages).sum())
+
+
+def _bucket_averages(daily: np.ndarray, buckets: np.ndarray, n_buckets: int) -> np.ndarray:
+    # Mean over the non-empty buckets of each row's per-day counts (NaN when all are empty)
+    totals = daily @ np.eye(n_buckets, dtype=np.int64)[buckets]
+    with np.errstate(invalid='ignore'):
+        return totals.sum(axis=1) / (totals > 0).sum(axis=1)
+
+
+def _streaks_and_gaps(daily: np.ndarray, ordinals: np.ndarray):
+    # Longest run of consecutive active days and longest gap between active
+    # days of every row, over all rows at once
+    rows, columns = np.nonzero(daily)
+    days = ordinals[columns]
+    longest_streak = np.zeros(len(daily), dtype=np.int64)
+    max_gap = np.zeros(len(daily), dtype=np.int64)
+    if len(rows) == 0:
+        return longest_streak, max_gap
+
+    same_row = rows[1:] == rows[:-1]
+    gaps = np.diff(days)
+    np.maximum.at(max_gap, rows[1:][same_row], gaps[same_row])
+
+    run_starts = np.r_[True, ~same_row | (gaps != 1)]
+    runs = np.cumsum(run_starts) - 1
+    np.maximum.at(longest_streak, rows[run_starts], np.bincount(runs))
+    return longest_streak, max_gap
+
+
+def _summary_table(chat: Chat) -> pd.DataFrame:
+    messages = chat.df['message'].to_numpy()
+    lengths = _lengths(messages)
+    per_message = pd.DataFrame({
+        'messages': np.ones(len(messages), dtype=np.int64),
+        'words': _lengths(messages, lambda message: len(message.split())),
+        'media': (messages == '<Media omitted>').astype(np.int64),
+        'links': _url_counts(messages),
+        'characters': lengths,
+        'longest': lengths,
+        'shortest': lengths,
+    })
+    aggregations = {'messages': 'sum', 'words': 'sum', 'media': 'sum', 'links': 'sum', 'characters': 'sum', 'longest': 'max', 'shortest': 'min'}
+    # One groupby pass for the participants, the whole frame for 'All'
+    per_user = per_message.groupby(chat.user_codes).agg(aggregations).reindex(range(len(chat.users)), fill_value=0)
+    totals = per_message.agg(aggregations).to_frame().T if len(messages) else pd.DataFrame(0, index=[0], columns=list(aggregations))
+    table = pd.concat([totals, per_user], ignore_index=True).astype(np.int64)
+
+    # Day level metrics from the activity cube: row 0 is 'All'
+    cube = chat.cube
+    counts = np.concatenate([cube.total[None], cube.counts.astype(np.int64)])
+    daily = counts.sum(axis=2)
+    day_names = cube.days['day_name'].cat.codes.to_numpy()
+    ordinals = cube.days['date'].to_numpy().astype('datetime64[D]').astype(np.int64)
+    longest_streak, max_gap = _streaks_and_gaps(daily, ordinals)
+
+    table = pd.DataFrame({
+        'total_messages': table['messages'],
+        'total_words': table['words'],
+        'total_media_messages': table['media'],
+        'total_links': table['links'],
+        'total_characters': table['characters'],
+        'average_words': table['words'] // table['messages'].clip(lower=1),
+        'longest_message_length': table['longest'],
+        'shortest_message_length': table['shortest'],
+        'most_active_day': pd.Categorical.from_codes((daily @ np.eye(7, dtype=np.int64)[day_names]).argmax(axis=1), categories=pre.DAY_NAMES, ordered=True),
+        'active_days': (daily > 0).sum(axis=1),
+        'longest_streak': longest_streak,
+        'max_gap': max_gap,
+        'per_month': _bucket_averages(daily, cube.days['month'].to_numpy() - 1, 12),
+        'per_day': _bucket_averages(daily, cube.days['day'].to_numpy() - 1, 31),
+        'per_week': _bucket_averages(daily, cube.days['week'].to_numpy().astype(np.int64) - 1, 53),
+        'per_hour': _bucket_averages(counts.sum(axis=1).reshape(-1, 2, 12).sum(axis=1), np.arange(12), 12),
+    })
+    table.index = pd.Index(['All'] + chat.users, name='user')
+    return table
 
 
-def create_wordcloud(df: pd.DataFrame, selected_user: str):
-    if selected_user != 'All':
-        df = df[df['user'] == selected_user]
-    all_messages = df[df['message'] != '<Media omitted>']['message'].to_list()
-    all_messages = ' '.join(all_messages)
-    
-    
-    doc = nlp(all_messages)
-    all_messages = ' '.join([token.text for token in doc if not token.is_stop and not token.is_punct])
+def summary_table(df: pd.DataFrame | Chat) -> pd.DataFrame:
+    """
+    Every metric stats() and get_averages() report, unformatted, for 'All'
+    and each participant (index `user`), computed in one pass per chat.
+    Switching users then reads a row of this table.
+    """
+    return _as_chat(df).derived('summary', _summary_table)
+
+
+def _summary_row(df: pd.DataFrame | Chat, selected_user: str) -> pd.Series:
+    table = summary_table(df)
+    if selected_user in table.index:
+        return table.loc[selected_user]
+    # Someone who never wrote in the chat
+    row = pd.Series(0, index=table.columns, dtype=object)
+    row['most_active_day'] = pre.DAY_NAMES[0]
+    row[AVERAGE_COLUMNS] = np.nan
+    return row
+
+
+def stats(df: pd.DataFrame | Chat, selected_user: str):
+    row = _summary_row(df, selected_user)
+    return tuple(
+        row[column] if column == 'most_active_day' else format_number_short(int(row[column]))
+        for column in STAT_COLUMNS
+    )
+
+
+def _distinct_counts(messages, approximate: bool):
+    extractor = get_url_extractor()
+    words, links = (HyperLogLog(), HyperLogLog()) if approximate else (set(), set())
+    for batch in _batches(messages[messages != '<Media omitted>']):
+        batch_words = set(NON_WORD_PATTERN.sub('', ' '.join(batch)).lower().split())
+        batch_links = {url for message in batch if URL_CANDIDATE_PATTERN.search(message) for url in extractor.find_urls(message)}
+        if approximate:
+            words.add(hash_tokens(list(batch_words)))
+            links.add(hash_tokens(list(batch_links)))
+        else:
+            words.update(batch_words)
+            links.update(batch_links)
+    if approximate:
+        return words.count(), links.count()
+    return len(words), len(links)
+
+
+def distinct_counts(df: pd.DataFrame | Chat, selected_user: str, approximate: bool = False):
+    """
+    Distinct words (case-insensitive) and distinct links of the selected
+    user. The exact count keeps every distinct value; the approximate one a
+    4 KiB HyperLogLog per kind, with a 1.6 % standard error.
+    """
+    chat = _as_chat(df)
+    return chat.derived(f'distinct-{selected_user}-{approximate}',
+                        lambda chat: _distinct_counts(chat.for_user(selected_user)['message'].to_numpy(), approximate))
 
-    wordcloud = WordCloud(width=800, height=400, background_color='black').generate(all_messages)
+
+def _value_counts(series: pd.Series):
+    # Categorical value_counts also lists categories that never occur
+    counts = series.value_counts()
+    return counts[counts > 0].reset_index()
+
+
+def most_busy_user(df: pd.DataFrame | Chat, selected_user: str):
+    df = _select(df, selected_user)
+    return _value_counts(df['user'])
+
+
+def wordcloud_frequencies(messages, batch_size=WORDCLOUD_BATCH_SIZE, n_process=1, tokenizer_only=True, keep_pipes=()):
+    """
+    Count the words that go into the wordcloud, one message batch at a time.
+    is_stop / is_punct are lexical attributes, so the tokenizer alone is
+    enough (tokenizer_only). Otherwise the messages run through nlp.pipe with
+    every component except `keep_pipes` disabled, optionally on `n_process`
+    processes.
+    """
+    nlp = get_nlp()
+    if tokenizer_only:
+        docs = nlp.tokenizer.pipe(messages, batch_size=batch_size)
+    else:
+        disable = [name for name in nlp.pipe_names if name not in keep_pipes]
+        docs = nlp.pipe(messages, batch_size=batch_size, n_process=n_process, disable=disable)
+
+    frequencies = Counter()
+    for doc in docs:
+        frequencies.update(token.text for token in doc if not (token.is_stop or token.is_punct or token.is_space))
+    return frequencies
+
+
+def _batches(values, size=APPROX_BATCH):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def sample_messages(messages, size=WORDCLOUD_SAMPLE, seed=0) -> np.ndarray:
+    # Uniform sample of `size` messages, drawn batch by batch
+    reservoir = Reservoir(size, seed)
+    for batch in _batches(messages):
+        reservoir.add(batch)
+    return reservoir.sample
+
+
+def create_wordcloud(df: pd.DataFrame | Chat, selected_user: str, approximate: bool = False, **options):
+    df = _select(df, selected_user)
+    all_messages = df.loc[df['message'] != '<Media omitted>', 'message'].to_numpy()
+    if approximate:
+        # Word proportions of a uniform sample match the whole chat's, which is all the cloud shows
+        all_messages = sample_messages(all_messages)
+
+    frequencies = wordcloud_frequencies(all_messages, **options)
+
+    from wordcloud import WordCloud
+    wordcloud = WordCloud(width=800, height=400, background_color='black').generate_from_frequencies(frequencies)
 
     return wordcloud
 
 
-def most_busy_month(df: pd.DataFrame, selected_user: str):
-    if selected_user != 'All':
-        df = df[df['user'] == selected_user]
-    most_busy_month_df = df.groupby(['year', 'month']).count()['message'].reset_index()
-    most_busy_month_df['busy_month'] = most_busy_month_df['month'] + ' - ' + most_busy_month_df['year'].astype(str)
+def _activity(df: pd.DataFrame | Chat, selected_user: str):
+    # Per-day table of the chat's active days with the selected user's counts
+    cube = _as_chat(df).cube
+    counts = cube.for_user(selected_user)
+    return cube.days.assign(message=counts.sum(axis=1)), counts
+
+
+def _top_counts(day_table: pd.DataFrame, column: str):
+    counts = day_table.groupby(column, observed=True)['message'].sum()
+    counts = counts[counts > 0].sort_values(ascending=False, kind='stable')
+    return counts.rename('count').reset_index()
+
+
+def _hour_labels():
+    # Labels for hours 0-23 in the '01 PM' style used by the charts
+    return [f"{hour % 12 or 12:02d} {'AM' if hour < 12 else 'PM'}" for hour in range(24)]
+
+
+def most_busy_month(df: pd.DataFrame | Chat, selected_user: str):
+    day_table, _ = _activity(df, selected_user)
+    most_busy_month_df = day_table.groupby(['year', 'month'])['message'].sum().reset_index()
+    most_busy_month_df = most_busy_month_df[most_busy_month_df['message'] > 0].reset_index(drop=True)
+    most_busy_month_df['busy_month'] = [f"{pre.MONTHS[month - 1]} - {year}" for year, month in zip(most_busy_month_df['year'], most_busy_month_df['month'])]
     most_busy_month_df = most_busy_month_df[['busy_month', 'message']]
     return most_busy_month_df
 
-def most_busy_day(df: pd.DataFrame, selected_user: str):
-    if selected_user != 'All':
-        df = df[df['user'] == selected_user]
-    return df['day_name'].value_counts().reset_index()
+def most_busy_day(df: pd.DataFrame | Chat, selected_user: str):
+    day_table, _ = _activity(df, selected_user)
+    return _top_counts(day_table, 'day_name')
 
 
-def most_busy_week(df: pd.DataFrame, selected_user: str):
-    if selected_user != 'All':
-        df = df[df['user'] == selected_user]
-    return df['week'].value_counts().reset_index()
+def most_busy_week(df: pd.DataFrame | Chat, selected_user: str):
+    day_table, _ = _activity(df, selected_user)
+    return _top_counts(day_table, 'week')
 
 
-def most_busy_hour(df: pd.DataFrame, selected_user: str):
-    if selected_user != 'All':
-        df = df[df['user'] == selected_user]
+def most_busy_hour(df: pd.DataFrame | Chat, selected_user: str):
+    _, counts = _activity(df, selected_user)
 
-    most_busy_hour = df.groupby(['hour', 'meridiem']).count()['message'].reset_index()
-    most_busy_hour.sort_values('hour', inplace=True)
-    most_busy_hour['busy_hour'] = most_busy_hour['hour'] + ' ' + most_busy_hour['meridiem']
+    hours = np.arange(24)
+    most_busy_hour = pd.DataFrame({
+        'hour': hours % 12 + (hours % 12 == 0) * 12,
+        'meridiem': np.where(hours < 12, 'AM', 'PM'),
+        'busy_hour': _hour_labels(),
+        'message': counts.sum(axis=0),
+    })
+    most_busy_hour = most_busy_hour[most_busy_hour['message'] > 0]
+    most_busy_hour = most_busy_hour.sort_values(['hour', 'meridiem'], ignore_index=True)
     most_busy_hour = most_busy_hour[['busy_hour', 'message']]
     return most_busy_hour
 
 
-def heatmap_activity(df: pd.DataFrame, selected_user: str = 'All'):
-    if selected_user != 'All':
-        df = df[df['user'] == selected_user]
+def heatmap_activity(df: pd.DataFrame | Chat, selected_user: str = 'All'):
+    day_table, counts = _activity(df, selected_user)
 
-    user_activity = df.groupby(['day_name', 'hour', 'meridiem']).count()['message'].reset_index()
-    user_activity['hour'] = user_activity['hour'].astype(str) + " " + user_activity['meridiem']
-    user_activity.drop(columns=['meridiem'], inplace=True)
-    heatmap_data = user_activity.groupby(['day_name', 'hour']).aggregate({'message': 'sum'}).unstack().fillna(0)
+    weekday_counts = np.zeros((7, 24))
+    np.add.at(weekday_counts, day_table['day_name'].cat.codes.to_numpy(), counts)
+
+    heatmap_data = pd.DataFrame(
+        weekday_counts,
+        index=pd.Index(pre.DAY_NAMES, name='day_name'),
+        columns=pd.MultiIndex.from_product([['message'], _hour_labels()], names=[None, 'hour']),
+    )
+    heatmap_data = heatmap_data.loc[:, weekday_counts.sum(axis=0) > 0].sort_index(axis=1)
 
-    ordered_days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    heatmap_data = heatmap_data.reindex(ordered_days)
+    # Days without any message stay empty, as with the groupby/unstack version
+    heatmap_data[weekday_counts.sum(axis=1) == 0] = np.nan
 
     return heatmap_data
 
 
-def get_line_chat_of_message_history(df: pd.DataFrame, selected_user: str):
-    if selected_user != 'All':
-        df = df[df['user'] == selected_user]
+def _resample(days: np.ndarray, counts: np.ndarray, freq: str):
+    # Sum per-day counts into every period from the first to the last active
+    # one; returns (period start dates, counts)
+    if freq == 'D':
+        periods, step = days, 1
+    elif freq == 'W':
+        # Day 0 (1970-01-01) was a Thursday, so Mondays are days with (day - 4) % 7 == 0
+        ordinals = days.view('int64')
+        periods, step = (ordinals - (ordinals - 4) % 7).view('datetime64[D]'), 7
+    elif freq == 'M':
+        periods, step = days.astype('datetime64[M]'), 1
+    else:
+        raise ValueError(f"Unknown frequency {freq!r}, expected one of {list(HISTORY_FREQUENCIES)}")
 
-    return df['date'].value_counts().reset_index()
+    ordinals = periods.view('int64')
+    if len(ordinals) == 0:
+        return periods.astype('datetime64[ns]'), np.zeros(0, dtype=np.int64)
+    buckets = (ordinals - ordinals[0]) // step
+    totals = np.bincount(buckets, weights=counts, minlength=buckets[-1] + 1).astype(np.int64)
+    starts = (ordinals[0] + step * np.arange(len(totals))).view(periods.dtype)
+    return starts.astype('datetime64[ns]'), totals
 
 
-def get_averages(df: pd.DataFrame, selected_user: str):
-    if selected_user != 'All':
-        df = df[df['user'] == selected_user]
+def _rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    # Mean of the last `window` values (fewer at the start), via a cumulative sum
+    sums = np.cumsum(values, dtype=np.float64)
+    sums[window:] = sums[window:] - sums[:-window]
+    return sums / np.minimum(np.arange(1, len(values) + 1), window)
 
-    # 1. Average Messages Per Month
-    avg_messages_per_month = df.groupby('month')['message'].count().mean()
 
-    # 2. Average Messages Per Day
-    avg_messages_per_day = df.groupby('day')['message'].count().mean()
+def get_line_chat_of_message_history(df: pd.DataFrame | Chat, selected_user: str, freq: str = 'D', window: int | None = None):
+    """
+    Messages per period in time order, periods without messages included.
+    `freq` is one of HISTORY_FREQUENCIES; with `window` a `rolling` column
+    holds the mean over the last `window` periods. Reduced from the activity
+    cube's per-day counts, so no row of the chat is read.
+    """
+    day_table, _ = _activity(df, selected_user)
+    active = day_table['message'].to_numpy() > 0
+    days = day_table['date'].to_numpy()[active].astype('datetime64[D]')
 
-    # 3. Average Messages Per Week
-    avg_messages_per_week = df.groupby('week')['message'].count().mean()
+    dates, counts = _resample(days, day_table['message'].to_numpy()[active], freq)
+    history = pd.DataFrame({'date': dates, 'count': counts})
+    if window:
+        history['rolling'] = _rolling_mean(counts, window)
+    return history
+
+
+def get_averages(df: pd.DataFrame | Chat, selected_user: str):
+    row = _summary_row(df, selected_user)
+    # Month, day of month, ISO week and clock hour buckets
+    return tuple(format_number_short(round(row[column], 2)) for column in AVERAGE_COLUMNS)
+
+
+def compare_users(df: pd.DataFrame | Chat, users) -> pd.DataFrame:
+    """
+    Side-by-side summary of `users` ('All' allowed): one formatted column
+    per user, one row per metric, read from the summary table.
+    """
+    return pd.DataFrame(
+        {user: [*stats(df, user), *get_averages(df, user)] for user in users},
+        index=pd.Index(list(SUMMARY_LABELS.values()), name='metric'),
+    )
 
-    # 4. Average Messages Per HOur
-    avg_messages_per_hour = df.groupby('hour')['message'].count().mean()
-    
-    return format_number_short(round(avg_messages_per_month, 2)), format_number_short(round(avg_messages_per_day, 2)), format_number_short(round(avg_messages_per_week, 2)), format_number_short(round(avg_messages_per_hour, 2))
+
+def _trie_pattern(words) -> str:
+    # Regex that walks a character trie of `words` instead of trying every
+    # alternative at each position; longer sequences win over their prefixes
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        singles, branches = [], []
+        for char, child in sorted(node.items()):
+            if char == '':
+                continue
+            if list(child) == ['']:
+                singles.append(re.escape(char))
+            else:
+                branches.append(re.escape(char) + build(child))
+        if singles:
+            branches.insert(0, singles[0] if len(singles) == 1 else '[' + ''.join(singles) + ']')
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return '(?:' + pattern + ')?' if '' in node else pattern
+
+    return build(trie)
+
+
+def _load_emoji_pattern():
+    return re.compile(_trie_pattern(emoji.EMOJI_DATA))
 
 
-def most_used_words_and_emojies(df: pd.DataFrame, selected_user: str):
+def get_emoji_pattern():
+    return _load_once('emoji_pattern', _load_emoji_pattern)
+
+
+def extract_emojis(text: str) -> list:
+    """
+    Emojis in `text`, keeping multi-codepoint sequences (ZWJ families, skin
+    tones, flags, keycaps) whole. Only non-ASCII runs can hold an emoji, and
+    a run that is exactly one emoji is a dict lookup.
+    """
+    pattern = get_emoji_pattern()
+    emojis = []
+    for run in EMOJI_CANDIDATE_PATTERN.findall(text):
+        if run in emoji.EMOJI_DATA:
+            emojis.append(run)
+        else:
+            emojis.extend(pattern.findall(run))
+    return emojis
+
+
+def _token_counts(chat: Chat) -> dict:
+    # One pass over each user's messages; Counters are kept per user and the
+    # 'All' totals are summed from them on first request
+    stop_words = get_stop_words()
+    messages = chat.df['message'].to_numpy()
+    counts = {'words': {}, 'emojis': {}}
+
+    for user in chat.users:
+        user_messages = messages[chat.positions(user)]
+        text = ' '.join(user_messages[user_messages != '<Media omitted>'])
+
+        counts['words'][user] = _without_stop_words(Counter(NON_WORD_PATTERN.sub('', text).split()), stop_words)
+        counts['emojis'][user] = Counter(extract_emojis(text))
+    return counts
+
+
+def _merge_token_counts(counts: dict, added: dict, removed: dict) -> dict:
+    # Counters of an extended chat: stored counts + new rows - replaced rows
+    merged = {}
+    for kind, user_counts in counts.items():
+        merged[kind] = {user: Counter(counter) for user, counter in user_counts.items()}
+        for user, counter in added[kind].items():
+            merged[kind].setdefault(user, Counter()).update(counter)
+        for user, counter in removed[kind].items():
+            merged[kind][user].subtract(counter)
+            merged[kind][user] = +merged[kind][user]
+    return merged
+
+
+def token_counter(df: pd.DataFrame | Chat, kind: str, selected_user: str = 'All') -> Counter:
+    """
+    Word (kind='words') or emoji (kind='emojis') counts of one user, or of
+    everyone for 'All'. Built once per chat; use .most_common(k) for top-k.
+    """
+    chat = _as_chat(df)
+    counts = chat.derived('tokens', _token_counts, merge=_merge_token_counts)[kind]
+    if selected_user == 'All':
+        return chat.derived(f'tokens_all_{kind}', lambda chat: sum(counts.values(), Counter()))
+    return counts.get(selected_user, Counter())
+
+
+def _without_stop_words(words: Counter, stop_words) -> Counter:
+    for word in [word for word in words if word.lower() in stop_words]:
+        del words[word]
+    return words
+
+
+def _token_sketches(chat: Chat) -> dict:
+    # Approximate counterpart of _token_counts: each user's messages are
+    # tokenized one batch at a time into a space-saving summary for that
+    # user and one for 'All', plus one Count-Min sketch per kind keyed by
+    # (user, token), so memory does not grow with the chat
+    stop_words = get_stop_words()
+    messages = chat.df['message'].to_numpy()
+    names = chat.users + ['All']
+    salts = dict(zip(names, hash_tokens(names)))
+    sketches = {
+        kind: {'top': {name: SpaceSaving(APPROX_TOP_K) for name in names}, 'count_min': CountMinSketch(), 'salts': salts}
+        for kind in ('words', 'emojis')
+    }
+
+    for user in chat.users:
+        user_messages = messages[chat.positions(user)]
+        for batch in _batches(user_messages[user_messages != '<Media omitted>']):
+            text = ' '.join(batch)
+            batch_counts = {
+                'words': _without_stop_words(Counter(NON_WORD_PATTERN.sub('', text).split()), stop_words),
+                'emojis': Counter(extract_emojis(text)),
+            }
+            for kind, counts in batch_counts.items():
+                if not counts:
+                    continue
+                hashes = hash_tokens(list(counts))
+                weights = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+                for name in (user, 'All'):
+                    sketches[kind]['top'][name].update(counts)
+                    sketches[kind]['count_min'].add(hashes ^ salts[name], weights)
+    return sketches
+
+
+def approximate_most_common(df: pd.DataFrame | Chat, kind: str, selected_user: str = 'All', n: int | None = None) -> list:
+    """
+    Approximate token_counter(...).most_common(n) in fixed memory: the
+    space-saving candidates of the user ranked by their Count-Min estimate,
+    capped by the space-saving upper bound. Estimates never undercount; see
+    sketches.py for the bounds.
+    """
+    chat = _as_chat(df)
+    sketch = chat.derived('token_sketches', _token_sketches)[kind]
+    summary = sketch['top'].get(selected_user)
+    if summary is None or not summary.counts:
+        return []
+
+    tokens = list(summary.counts)
+    upper = np.fromiter(summary.counts.values(), dtype=np.int64, count=len(tokens)) + summary.error
+    estimates = np.minimum(sketch['count_min'].estimate(hash_tokens(tokens) ^ sketch['salts'][selected_user]), upper)
+    order = np.argsort(-estimates, kind='stable')[:n]
+    return [(tokens[i], int(estimates[i])) for i in order]
+
+
+def most_common_tokens(df: pd.DataFrame | Chat, kind: str, selected_user: str = 'All', n: int | None = None, approximate: bool = False) -> list:
+    # (token, count) of the `n` most used words or emojis, exact or from the sketches
+    if approximate:
+        return approximate_most_common(df, kind, selected_user, n)
+    return token_counter(df, kind, selected_user).most_common(n)
+
+
+def most_used_words_and_emojies(df: pd.DataFrame | Chat, selected_user: str, approximate: bool = False):
     
-    if selected_user != 'All':
-        df = df[df['user'] == selected_user]
+    chat = _as_chat(df)
     
-    users = []
+    users = [user for user in chat.users if selected_user in ('All', user)]
     most_used_words = []
     most_used_emojies = []
 
-    for user in set(df['user'].values.tolist()):
-        users.append(user)
+    def most_common(kind, user):
+        return most_common_tokens(chat, kind, user, 5, approximate)
 
-        user_df = df[df['user'] == user]
-        all_messages = user_df[user_df['message'] != '<Media omitted>']['message'].values
-        all_messages = ' '.join(all_messages)
-
-        all_messages_words = re.sub(r'[^\w\s]', '', all_messages).split()
-        all_messages_words = [word for word in all_messages_words if word.lower() not in stop_words.STOP_WORDS]
-        
+    for user in users:
         # Most Used Words
-        most_used_words.append(", ".join([item[0] for item in Counter(all_messages_words).most_common(5)]))
+        most_used_words.append(", ".join([item[0] for item in most_common('words', user)]))
 
         # Most Used Emoji
-        all_messages_emojies = ''.join(c for c in all_messages if emoji.is_emoji(c))
-        most_used_emojies.append(", ".join([item[0] for item in Counter(all_messages_emojies).most_common(5)]))
+        most_used_emojies.append(", ".join([item[0] for item in most_common('emojis', user)]))
 
 
     return pd.DataFrame({'User': users, 'Most Used Words': most_used_words, 'Most Used Emojies': most_used_emojies})
 
 
-def sentiment_analysis(df: pd.DataFrame, selected_user: str):
-    if selected_user != 'All':
-        df = df[df['user'] == selected_user]
+def _init_sentiment_worker():
+    # Runs in each fresh pool process: load VADER directly, outside _load_once's locks
+    _resources['sentiment_analyzer'] = _load_sentiment_analyzer()
 
-    users = []
-    message_counts = []
-    positive_ratio = []
-    neutral_ratio = []
-    negative_ratio = []
-    overall_mood = []
 
-    for user in set(df['user'].values.tolist()):
-        if user.lower() == 'whatsapp':
-            continue
+def _score_texts(texts) -> np.ndarray:
+    sia = get_sentiment_analyzer()
+    return np.fromiter((sia.polarity_scores(text)['compound'] for text in texts), dtype=np.float32, count=len(texts))
 
-        user_df = df[(df['user'] == user) & (df['message'] != '<Media omitted>')]
-        messages = user_df['message'].values.tolist()
 
-        pos, neu, neg = 0, 0, 0
+def sentiment_scores(messages, workers=None) -> np.ndarray:
+    """
+    VADER compound score per message. Identical texts ("ok", "lol", ...) are
+    scored once, and large sets of unique texts are spread over a process pool.
+    """
+    if workers is None:
+        workers = SENTIMENT_WORKERS
+    codes, uniques = pd.factorize(np.asarray(messages, dtype=object))
+
+    if workers > 1 and len(uniques) >= SENTIMENT_PARALLEL_MIN:
+        chunks = np.array_split(uniques, workers * 4)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=pre.pool_context(), initializer=_init_sentiment_worker) as executor:
+            scores = np.concatenate(list(executor.map(_score_texts, chunks)))
+    else:
+        scores = _score_texts(uniques)
+    return scores[codes]
 
-        for msg in messages:
-            score = sia.polarity_scores(msg)
-            if score['compound'] >= 0.05:
-                pos += 1
-            elif score['compound'] <= -0.05:
-                neg += 1
-            else:
-                neu += 1
 
-        total = len(messages)
-        if total == 0:
-            continue
+def _sentiment_column(chat: Chat, workers=None) -> np.ndarray:
+    # Media placeholders are not scored and stay NaN
+    messages = chat.df['message'].to_numpy()
+    is_text = messages != '<Media omitted>'
+    scores = np.full(len(messages), np.nan, dtype=np.float32)
+    scores[is_text] = sentiment_scores(messages[is_text], workers)
+    return scores
 
-        users.append(user)
-        message_counts.append(total)
-        positive_ratio.append(f"{round((pos / total) * 100, 2)}%")
-        neutral_ratio.append(f"{round((neu / total) * 100, 2)}%")
-        negative_ratio.append(f"{round((neg / total) * 100, 2)}%")
 
-        mood = max([(pos, '🟡 Positive Vibes Only'), (neu, '⚪ Calm & Collected'), (neg, '🔵 Might Need a Hug')], key=lambda x: x[0])[1]
-        overall_mood.append(mood)
+def sentiment_table(df: pd.DataFrame | Chat, selected_user: str = 'All', workers=None) -> pd.DataFrame:
+    """
+    Per participant: scored messages, positive / neutral / negative counts
+    and shares (0-1), and `mood`, the index in MOODS of the most frequent
+    one. `workers` bounds the scoring pool (SENTIMENT_WORKERS by default).
+    """
+    chat = _as_chat(df)
+    scores = chat.row_values('sentiment', functools.partial(_sentiment_column, workers=workers))
+
+    scored = pd.DataFrame({'user': chat.df['user'], 'sentiment': scores})
+    if selected_user != 'All':
+        scored = scored.take(chat.positions(selected_user))
+    scored = scored[scored['sentiment'].notna() & (scored['user'].astype(str).str.lower() != 'whatsapp')]
+
+    # 0 = positive, 1 = neutral, 2 = negative
+    mood = np.select([scored['sentiment'] >= 0.05, scored['sentiment'] <= -0.05], [0, 2], 1)
+    counts = scored.groupby(['user', mood], observed=True).size().unstack(fill_value=0).reindex(columns=[0, 1, 2], fill_value=0)
+    total = counts.sum(axis=1).to_numpy()
+
+    table = pd.DataFrame({'user': counts.index.astype(str), 'messages': total})
+    for column, name in enumerate(['positive', 'neutral', 'negative']):
+        table[name] = counts[column].to_numpy()
+    for name in ['positive', 'neutral', 'negative']:
+        table[f'{name}_share'] = table[name] / total
+    # Ties go to the first mood, positive before neutral before negative
+    table['mood'] = np.argmax(counts.to_numpy(), axis=1) if len(counts) else np.zeros(0, dtype=np.int64)
+    return table
+
+
+def sentiment_analysis(df: pd.DataFrame | Chat, selected_user: str, workers=None):
+    table = sentiment_table(df, selected_user, workers)
+
+    def ratio(name):
+        return [f"{value}%" for value in (table[f'{name}_share'] * 100).round(2)]
 
     # Build final DataFrame
     sentiment_summary = pd.DataFrame({
-        'User': users,
-        'No Messages': message_counts,
-        'Positive': positive_ratio,
-        'Neutral': neutral_ratio,
-        'Negative': negative_ratio,
-        'Overall Mood': overall_mood
+        'User': table['user'],
+        'No Messages': table['messages'],
+        'Positive': ratio('positive'),
+        'Neutral': ratio('neutral'),
+        'Negative': ratio('negative'),
+        'Overall Mood': np.array(MOODS)[table['mood'].to_numpy()],
     })
     
     return sentiment_summary, sentiment_summary['Overall Mood'].value_counts().reset_index()
 
 
-def get_most_mentioned_users(df: pd.DataFrame, selected_user: str):
-    if selected_user != 'All':
-        df = df[df['user'] == selected_user]
+def _mention_aliases(user: str, stop_words) -> set:
+    # Full name, each name part long enough to be meaningful, and the
+    # "@<digits>" handle WhatsApp inserts when mentioning a phone number
+    name = user.lower()
+    aliases = {name}
+    aliases.update(part for part in name.split() if len(part) >= 3 and any(char.isalpha() for char in part) and part not in stop_words)
+    digits = ''.join(char for char in name if char.isdigit())
+    if len(digits) >= 7:
+        aliases.add('@' + digits)
+    return aliases
+
+
+def _mention_matrix(chat: Chat) -> pd.DataFrame:
+    # All aliases go into one trie-shaped, case-insensitive regex that scans
+    # the chat once; matches are attributed to their message by offset.
+    stop_words = get_stop_words()
+    users = chat.users
+    targets = {}
+    for code, user in enumerate(users):
+        if user.lower() == 'whatsapp':
+            continue
+        for alias in _mention_aliases(user, stop_words):
+            targets.setdefault(alias, []).append(code)
+
+    matrix = np.zeros((len(users), len(users)), dtype=np.int64)
+    if targets:
+        pattern = re.compile(r'(?<!\w)(?:' + _trie_pattern(targets) + r')(?!\w)', re.IGNORECASE)
+        messages = chat.df['message'].to_numpy()
+        starts = np.concatenate([[0], np.cumsum(_lengths(messages) + 1)[:-1]])
+        senders = chat.user_codes
+
+        positions = []
+        found = []
+        for match in pattern.finditer('\n'.join(messages)):
+            positions.append(match.start())
+            found.append(match.group().lower())
+
+        # Matches per (sender, alias), then each alias credited to its users
+        alias_codes, aliases = pd.factorize(pd.Series(found, dtype=object))
+        sender_codes = senders[np.searchsorted(starts, positions, side='right') - 1]
+        counts = np.bincount(sender_codes * len(aliases) + alias_codes, minlength=len(users) * len(aliases)).reshape(len(users), len(aliases))
+        for column, alias in enumerate(aliases):
+            for target in targets.get(alias, ()):
+                matrix[:, target] += counts[:, column]
+        np.fill_diagonal(matrix, 0)
+
+    return pd.DataFrame(matrix, index=pd.Index(users, name='mentioned_by'), columns=pd.Index(users, name='mentioned'))
+
+
+def mention_matrix(df: pd.DataFrame | Chat) -> pd.DataFrame:
+    """
+    Who-mentions-whom counts: rows are the senders, columns the participants
+    they mention (by full name, a name part, or their @phone handle).
+    """
+    return _as_chat(df).derived('mentions', _mention_matrix)
 
-    temp_df = df.sort_values(by='date').reset_index(drop=True)
-    users = temp_df['user'].unique().tolist()
-    mentioned_users = []
-    
-    for i in range(len(temp_df) - 1):
-        current_user = temp_df.loc[i, 'user']
-        current_msg = temp_df.loc[i, 'message']
-
-        # Check if message mentions any user (excluding self)
-        for user in users:
-            for word in current_msg.split():
-                if word.lower() in user.lower():
-                    if user != current_user:
-                        mentioned_users.append(user)
-                        
-    mentioned_users_count = Counter(mentioned_users)
-    most_mentioned_users = mentioned_users_count.most_common(10)
-    return most_mentioned_users
\ No newline at end of file
+
+def get_most_mentioned_users(df: pd.DataFrame | Chat, selected_user: str):
+    matrix = mention_matrix(df)
+
+    if selected_user == 'All':
+        mentioned_users_count = matrix.sum(axis=0)
+    elif selected_user in matrix.index:
+        mentioned_users_count = matrix.loc[selected_user]
+    else:
+        return []
+
+    mentioned_users_count = mentioned_users_count[mentioned_users_count > 0].sort_values(ascending=False, kind='stable')
+    most_mentioned_users = [(user, int(count)) for user, count in mentioned_users_count.head(10).items()]
+    return most_mentioned_users